@@ -1,10 +1,45 @@
 # Copyright (C) 2022, Francis LaBounty, All rights reserved.
 
+import importlib
+import sys
+
 import bpy
-from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
-from sympy import symbols, lambdify, diff
 
-from . import nodes
+from . import background
+
+
+class LazyModule():
+    """
+    Module proxy that only imports the module on first attribute access, so enabling
+    the addon does not pay for importing sympy and numpy until a graph is created
+    """
+
+    def __init__(self, name, package=None):
+        # Set on the proxy itself, other attributes are forwarded to the module
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'package', package)
+        object.__setattr__(self, 'module', None)
+
+    def load(self):
+        if self.module is None:
+            object.__setattr__(self, 'module', importlib.import_module(self.name, self.package))
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        # Importing a submodule replaces its proxy in the package, but modules that did
+        # "from . import x" before that still hold the proxy and must write to the module
+        setattr(self.load(), attr, value)
+
+
+sympy = LazyModule('sympy')
+expressions = LazyModule('.expressions', __package__)
+nodes = LazyModule('.nodes', __package__)
+simplify = LazyModule('.simplify', __package__)
+batch = LazyModule('.batch', __package__)
+streamlines = LazyModule('.streamlines', __package__)
 
 bl_info = {
     "name": "Graph",
@@ -21,30 +56,45 @@ bl_info = {
 }
 
 
-def parse_functions(funcs, convert_func=True):
-    # Parse expression
+def parse_functions(funcs):
+    # Parse expression (cached)
+    syms = {'x', 'y', 'z'}
     for i, func in enumerate(funcs):
-        funcs[i] = parse_expr(func, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
-
-    # Instantiate sympy symbols and lambdify function
-    x, y, z = symbols('x y z')
-    syms = funcs[0].free_symbols
-    for i in range(1, len(funcs)):
-        syms.update(funcs[i].free_symbols)
-    syms.add(x)
-    syms.add(y)
-    syms.add(z)
+        funcs[i], free_symbols = expressions.parse(func)
+        syms.update(free_symbols)
     syms = list(syms)
 
-    if convert_func:
-        for i, func in enumerate(funcs):
-            funcs[i] = lambdify(syms, func)
-
-        syms = [str(x) for x in syms]
     return (funcs, syms)
 
 
+def node_limit_guard(execute):
+    """
+    Report expressions over the node limit as an operator error instead of raising
+    """
+    def guarded(self, context):
+        try:
+            return execute(self, context)
+        except simplify.NodeLimitError as error:
+            self.report({'ERROR'}, str(error))
+            return {"CANCELLED"}
+
+    return guarded
+
+
+def node_limit_report(label, build):
+    """
+    Report expressions over the node limit when a background job applies build, the
+    error node_limit_guard reports for execute
+    """
+    def guarded(result):
+        try:
+            build(result)
+        except simplify.NodeLimitError as error:
+            background.report(f"{label}: {error}")
+
+    return guarded
+
+
 def replace_symbols(funcs, syms):
     coords = ['x', 'y', 'z']
     for i, func in enumerate(funcs):
@@ -67,6 +117,7 @@ class GN_OT_CreateCurve(bpy.types.Operator):
     bl_idname = "mesh.gn_create_curve"
     bl_label = "Create Curve"
 
+    @node_limit_guard
     def execute(self, context):
         wm = context.window_manager
 
@@ -85,6 +136,7 @@ class GN_OT_CreateGraph(bpy.types.Operator):
     bl_idname = "mesh.gn_create_graph"
     bl_label = "Create Graph"
 
+    @node_limit_guard
     def execute(self, context):
         wm = context.window_manager
 
@@ -104,6 +156,7 @@ class GN_OT_CreateScatter(bpy.types.Operator):
     bl_idname = "mesh.gn_create_scatter_plot"
     bl_label = "Create Scatter Plot"
 
+    @node_limit_guard
     def execute(self, context):
         wm = context.window_manager
 
@@ -123,6 +176,7 @@ class GN_OT_CreateContour(bpy.types.Operator):
     bl_idname = "mesh.gn_create_contour_plot"
     bl_label = "Create Contour Plot"
 
+    @node_limit_guard
     def execute(self, context):
         wm = context.window_manager
 
@@ -155,35 +209,55 @@ class GN_OT_CreateTangentPlane(bpy.types.Operator):
     bl_idname = "mesh.gn_create_tangent_plane"
     bl_label = "Create Tangent Plane"
 
-    def execute(self, context):
-        wm = context.window_manager
+    @staticmethod
+    def symbolic(function, point, report):
+        """
+        Symbolic part of the operator, safe to run outside of the main thread
+        """
+        x_, y_, z_ = point
 
         # Parse expression
-        func = parse_expr(wm.function, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
+        report("Parsing")
+        func = expressions.parse(function)[0]
 
         # Instantiate symbolic (x, y, z)
-        x, y, z = symbols("x y z")
+        x, y, z = sympy.symbols("x y z")
+
+        # F and ∇F at the evaluation point (derivatives are cached per expression)
+        report("Differentiating")
+        value, grad, _ = expressions.taylor_function(func)(x_, y_, z_)
 
-        diffx = diff(func, x)  # ∂F/∂x
-        diffy = diff(func, y)  # ∂F/∂y
-        diffz = diff(func, z)  # ∂F/∂z
-        diffx = lambdify((x, y, z), diffx)  # lambdify ∂F/∂x
-        diffy = lambdify((x, y, z), diffy)  # lambdify ∂F/∂y
-        diffz = lambdify((x, y, z), diffz)  # lambdify ∂F/∂z
-        func = lambdify((x, y, z), func)  # lambdify function
+        tangent_plane_func = value + \
+            grad[0] * (x - x_) + grad[1] * (y - y_) + grad[2] * (z - z_)
 
-        tangent_plane_func = func(wm.x_, wm.y_, wm.z_) + \
-            diffx(wm.x_, wm.y_, wm.z_) * (x - wm.x_) + diffy(wm.x_, wm.y_, wm.z_) * \
-            (y - wm.y_) + diffz(wm.x_, wm.y_, wm.z_) * (z - wm.z_)
+        return (tangent_plane_func, str(tangent_plane_func), point)
 
-        wm.tangent_plane_function = str(tangent_plane_func)
+    @staticmethod
+    def build(result):
+        wm = bpy.context.window_manager
+        tangent_plane_func, text, (x_, y_, z_) = result
 
-        tangent_plane_func = lambdify((x, y, z), tangent_plane_func)
+        wm.tangent_plane_function = text
 
         nodes.create_graph("Tangent Graph", tangent_plane_func, ['x', 'y', 'z'], 5, 5, 2,
                            2, False, wm.insert_point, True, wm.color_flag,
-                           wm.color_min, wm.color_max, wm.x_, wm.y_, wm.z_, 'tangent')
+                           wm.color_min, wm.color_max, x_, y_, z_, 'tangent')
+
+    @node_limit_guard
+    def execute(self, context):
+        wm = context.window_manager
+
+        self.build(self.symbolic(wm.function, (wm.x_, wm.y_, wm.z_), background.no_report))
+
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        function, point = wm.function, (wm.x_, wm.y_, wm.z_)
+
+        # Keep the UI responsive while sympy runs, build the graph once it is done
+        background.submit(self.bl_label, lambda report: GN_OT_CreateTangentPlane.symbolic(
+            function, point, report), node_limit_report(self.bl_label, GN_OT_CreateTangentPlane.build))
 
         return {"FINISHED"}
 
@@ -194,54 +268,62 @@ class GN_OT_CreateQuadraticApproximation(bpy.types.Operator):
     bl_idname = "mesh.gn_create_quadratic_approximation"
     bl_label = "Create Quadratic Approximation"
 
-    def execute(self, context):
-        wm = context.window_manager
+    @staticmethod
+    def symbolic(function, point, report):
+        """
+        Symbolic part of the operator, safe to run outside of the main thread
+        """
+        x_, y_, z_ = point
 
         # Parse expression
-        func = parse_expr(wm.function, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
+        report("Parsing")
+        func = expressions.parse(function)[0]
 
         # Instantiate symbolic (x, y, z)
-        x, y, z = symbols("x y z")
-
-        diffx = diff(func, x)  # ∂F/∂x
-        diffy = diff(func, y)  # ∂F/∂y
-        diffz = diff(func, z)  # ∂F/∂z
-        diffxx = diff(diffx, x)  # ∂²F/∂x²
-        diffyy = diff(diffy, y)  # ∂²F/∂y²
-        diffzz = diff(diffz, z)  # ∂²F/∂z²
-        diffxy = diff(diffx, y)  # ∂²F/∂xy
-        diffxz = diff(diffx, z)  # ∂²F/∂xz
-        diffyz = diff(diffy, z)  # ∂²F/∂yz
-
-        diffx = lambdify((x, y, z), diffx)  # lambdify ∂F/∂x
-        diffy = lambdify((x, y, z), diffy)  # lambdify ∂F/∂y
-        diffz = lambdify((x, y, z), diffz)  # lambdify ∂F/∂z
-        diffxx = lambdify((x, y, z), diffxx)  # ∂²F/∂x²
-        diffyy = lambdify((x, y, z), diffyy)  # ∂²F/∂y²
-        diffzz = lambdify((x, y, z), diffzz)  # ∂²F/∂z²
-        diffxy = lambdify((x, y, z), diffxy)  # ∂²F/∂xy
-        diffxz = lambdify((x, y, z), diffxz)  # ∂²F/∂xz
-        diffyz = lambdify((x, y, z), diffyz)  # ∂²F/∂yz
-        func = lambdify((x, y, z), func)  # lambdify function
-
-        quad_approx_func = func(wm.x_, wm.y_, wm.z_) + \
-            diffx(wm.x_, wm.y_, wm.z_) * (x - wm.x_) + diffy(wm.x_, wm.y_, wm.z_) * \
-            (y - wm.y_) + diffz(wm.x_, wm.y_, wm.z_) * (z - wm.z_) + \
-            diffxy(wm.x_, wm.y_, wm.z_) * (x - wm.x_) * (y - wm.y_) + \
-            diffxz(wm.x_, wm.y_, wm.z_) * (x - wm.x_) * (z - wm.y_) + \
-            diffyz(wm.x_, wm.y_, wm.z_) * (y - wm.y_) * (z - wm.z_) + \
-            0.5 * (diffxx(wm.x_, wm.y_, wm.z_) * (x - wm.x_)**2 +
-                   diffyy(wm.x_, wm.y_, wm.z_) * (y - wm.y_)**2 +
-                   diffzz(wm.x_, wm.y_, wm.z_) * (z - wm.z_)**2)
-
-        wm.quadratic_approximation_function = str(quad_approx_func)
-
-        quad_approx_func = lambdify((x, y, z), quad_approx_func)
+        x, y, z = sympy.symbols("x y z")
+
+        # F, ∇F and the Hessian at the evaluation point (derivatives are cached per
+        # expression)
+        report("Differentiating")
+        value, grad, hess = expressions.taylor_function(func)(x_, y_, z_)
+
+        quad_approx_func = value + \
+            grad[0] * (x - x_) + grad[1] * (y - y_) + grad[2] * (z - z_) + \
+            hess[0][1] * (x - x_) * (y - y_) + \
+            hess[0][2] * (x - x_) * (z - z_) + \
+            hess[1][2] * (y - y_) * (z - z_) + \
+            0.5 * (hess[0][0] * (x - x_)**2 +
+                   hess[1][1] * (y - y_)**2 +
+                   hess[2][2] * (z - z_)**2)
+
+        return (quad_approx_func, str(quad_approx_func), point)
+
+    @staticmethod
+    def build(result):
+        wm = bpy.context.window_manager
+        quad_approx_func, text, (x_, y_, z_) = result
+
+        wm.quadratic_approximation_function = text
 
         nodes.create_graph("Quad Approx Graph", quad_approx_func, ['x', 'y', 'z'], 5, 5, 50,
                            50, False, wm.insert_point, True, wm.color_flag,
-                           wm.color_min, wm.color_max, wm.x_, wm.y_, wm.z_, 'quad')
+                           wm.color_min, wm.color_max, x_, y_, z_, 'quad')
+
+    @node_limit_guard
+    def execute(self, context):
+        wm = context.window_manager
+
+        self.build(self.symbolic(wm.function, (wm.x_, wm.y_, wm.z_), background.no_report))
+
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        function, point = wm.function, (wm.x_, wm.y_, wm.z_)
+
+        # Keep the UI responsive while sympy runs, build the graph once it is done
+        background.submit(self.bl_label, lambda report: GN_OT_CreateQuadraticApproximation.symbolic(
+            function, point, report), node_limit_report(self.bl_label, GN_OT_CreateQuadraticApproximation.build))
 
         return {"FINISHED"}
 
@@ -252,36 +334,111 @@ class GN_OT_CreateGradientField(bpy.types.Operator):
     bl_idname = "mesh.gn_create_gradient_field"
     bl_label = "Create Gradient Field"
 
-    def execute(self, context):
-        wm = context.window_manager
-
+    @staticmethod
+    def symbolic(function, report):
+        """
+        Symbolic part of the operator, safe to run outside of the main thread
+        """
         # Parse expression
-        funcs, syms = parse_functions([wm.function], False)
+        report("Parsing")
+        funcs, syms = parse_functions([function])
 
-        # Instantiate symbolic (x, y, z)
-        x, y, z = symbols("x y z")
-
-        diffx = diff(*funcs, x)  # ∂F/∂x
-        diffy = diff(*funcs, y)  # ∂F/∂y
-        diffz = diff(*funcs, z)  # ∂F/∂z
+        # ∇F (cached per expression)
+        report("Differentiating")
+        diffx, diffy, diffz = expressions.gradient(*funcs)
 
-        wm.diffx = str(diffx)
-        wm.diffy = str(diffy)
-        wm.diffz = str(diffz)
+        return (funcs, syms, (diffx, diffy, diffz), (str(diffx), str(diffy), str(diffz)))
 
-        diffx = lambdify(syms, diffx)  # lambdify ∂F/∂x
-        diffy = lambdify(syms, diffy)  # lambdify ∂F/∂y
-        diffz = lambdify(syms, diffz)  # lambdify ∂F/∂z
-        func = lambdify(syms, *funcs)  # lambdify function
+    @staticmethod
+    def build(result):
+        wm = bpy.context.window_manager
+        funcs, syms, (diffx, diffy, diffz), texts = result
 
-        syms = [str(x) for x in syms]
+        wm.diffx, wm.diffy, wm.diffz = texts
 
         nodes.create_vector_field(
-            func, diffx, diffy, diffz, syms, wm.join_graph, wm.join_graph, wm.use_length, wm.color_flag, wm.color_min, wm.color_max, 20, 20, 50, 50)
+            *funcs, diffx, diffy, diffz, syms, wm.join_graph, wm.join_graph, wm.use_length, wm.color_flag, wm.color_min, wm.color_max, 20, 20, 50, 50,
+            wm.seeding, wm.seed_spacing, wm.seed_count)
+
+    @node_limit_guard
+    def execute(self, context):
+        wm = context.window_manager
+
+        self.build(self.symbolic(wm.function, background.no_report))
+
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        function = context.window_manager.function
+
+        # Keep the UI responsive while sympy runs, build the field once it is done
+        background.submit(self.bl_label, lambda report: GN_OT_CreateGradientField.symbolic(
+            function, report), node_limit_report(self.bl_label, GN_OT_CreateGradientField.build))
 
         return {"FINISHED"}
 
 
+def stream_functions(wm, gradient):
+    """
+    Panel expressions a vector stream is made from, (F,) for a gradient descent/ascent
+    and (Fx, Fy, Fz) otherwise
+    """
+    if gradient:
+        return (wm.function,)
+    return (wm.functionx, wm.functiony, wm.functionz)
+
+
+def stream_field(functions, gradient):
+    """
+    (F, field, source) of a vector stream from its expressions (see stream_functions):
+    the lambdified F a gradient descent/ascent stays on (None otherwise), the
+    lambdified field (∇F or < Fx, Fy, Fz >) and the sympy ((P, Q, R), F) they came from
+    """
+    if gradient:
+        # Parse expression and take ∇F (cached per expression)
+        func = expressions.parse(functions[0])[0]
+        grad = expressions.gradient(func)
+        return (expressions.compile_function(func), expressions.compile_field(grad), (grad, func))
+
+    # Parse and lambdify < Fx, Fy, Fz > as one function (cached)
+    exprs = tuple(expressions.parse(function)[0] for function in functions)
+    return (None, expressions.compile_field(exprs), (exprs, None))
+
+
+def update_stream(context):
+    """
+    Integrate the active vector stream again with the panel settings, in place, keeping
+    the expressions it was made from. Returns the reason it could not be updated, None
+    once it is
+    """
+    obj = context.active_object
+    if obj is None or obj.type != 'MESH' or 'stream_seeds' not in obj:
+        return "Active object is not a vector stream"
+
+    wm = context.window_manager
+    gradient = obj['stream_gradient']
+
+    # Streams made before their expressions were stored use the panel expressions
+    functions = obj.get('stream_functions')
+    functions = functions.split('\n') if functions else stream_functions(wm, gradient)
+    func, field, source = stream_field(functions, gradient)
+
+    if not nodes.update_vector_stream(
+            obj, func, field, wm.dt, wm.steps, wm.limit, wm.integrator, wm.tolerance, wm.min_speed,
+            wm.max_length, wm.seed_spacing, wm.workers if wm.parallel else -1, source):
+        return f"Seed object {obj['stream_seeds']} of the vector stream no longer exists"
+    return None
+
+
+def update_streams(self, context):
+    """
+    Update callback of the stream settings, redrawing the active stream while live
+    updates are on
+    """
+    if context.window_manager.live_streams:
+        update_stream(context)
+
+
 class GN_OT_CreateGradientDescentAscent(bpy.types.Operator):
     """Create gradient descent or gradient ascent vector stream from < Fx(x,y,z), Fy(x,y,z), Fz(x,y,z) >"""
 
@@ -291,31 +448,20 @@ class GN_OT_CreateGradientDescentAscent(bpy.types.Operator):
     def execute(self, context):
         wm = context.window_manager
 
-        # Parse expression
-        func = parse_expr(wm.function, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
-
-        # Instantiate symbolic (x, y, z)
-        x, y, z = symbols("x y z")
-
-        diffx = diff(func, x)  # ∂F/∂x
-        diffy = diff(func, y)  # ∂F/∂y
-        diffz = diff(func, z)  # ∂F/∂z
-
-        wm.diffx = str(diffx)
-        wm.diffy = str(diffy)
-        wm.diffz = str(diffz)
-
-        diffx = lambdify((x, y, z), diffx)  # lambdify ∂F/∂x
-        diffy = lambdify((x, y, z), diffy)  # lambdify ∂F/∂y
-        diffz = lambdify((x, y, z), diffz)  # lambdify ∂F/∂z
-        func = lambdify((x, y, z), func)  # lambdify function
-
         gradient = 'descent' if wm.gradient_dir else 'ascent'
+        functions = stream_functions(wm, gradient)
+        func, field, source = stream_field(functions, gradient)
+
+        wm.diffx, wm.diffy, wm.diffz = (str(diff) for diff in source[0])
 
         nodes.create_vector_stream(
-            func, diffx, diffy, diffz, wm.dt, wm.steps, wm.color_flag, wm.color_min,
-            wm.color_max, wm.limit, gradient)
+            func, field, wm.dt, wm.steps, wm.color_flag, wm.color_min,
+            wm.color_max, wm.limit, gradient, wm.integrator, wm.tolerance, wm.min_speed,
+            wm.max_length, wm.seeding, wm.seed_spacing, wm.seed_count,
+            wm.workers if wm.parallel else -1, source)
+
+        # Remember the expressions for update_stream, one per line
+        context.active_object['stream_functions'] = '\n'.join(functions)
 
         return {"FINISHED"}
 
@@ -326,6 +472,7 @@ class GN_OT_CreateVectorField(bpy.types.Operator):
     bl_idname = "mesh.gn_create_vector_field"
     bl_label = "Create Vector Field"
 
+    @node_limit_guard
     def execute(self, context):
         wm = context.window_manager
 
@@ -339,7 +486,8 @@ class GN_OT_CreateVectorField(bpy.types.Operator):
             funcs.insert(0, None)
 
         nodes.create_vector_field(
-            *funcs, syms, wm.on_graph, wm.join_graph, wm.use_length, wm.color_flag, wm.color_min, wm.color_max, 20, 20, 50, 50)
+            *funcs, syms, wm.on_graph, wm.join_graph, wm.use_length, wm.color_flag, wm.color_min, wm.color_max, 20, 20, 50, 50,
+            wm.seeding, wm.seed_spacing, wm.seed_count)
 
         return {"FINISHED"}
 
@@ -350,52 +498,70 @@ class GN_OT_CreateCurlField(bpy.types.Operator):
     bl_idname = "mesh.gn_create_curl_field"
     bl_label = "Create Curl Vector Field"
 
-    def execute(self, context):
-        wm = context.window_manager
-
+    @staticmethod
+    def symbolic(functions, on_graph, report):
+        """
+        Symbolic part of the operator, safe to run outside of the main thread
+        """
         # Parse expression
-        if wm.on_graph:
-            funcs, syms = parse_functions(
-                [wm.function, wm.functionx, wm.functiony, wm.functionz], False)
-            idx = 1
-        else:
-            funcs, syms = parse_functions(
-                [wm.functionx, wm.functiony, wm.functionz], False)
-            idx = 0
+        report("Parsing")
+        funcs, syms = parse_functions(list(functions))
+        idx = 1 if on_graph else 0
 
-        # Instantiate symbolic (x, y, z)
-        x, y, z = symbols('x y z')
+        # Jacobian of < Fx, Fy, Fz > (cached per expression)
+        report("Differentiating")
+        jacobian = expressions.jacobian(funcs[idx:idx+3])
 
-        diffXy = diff(funcs[idx], y)  # ∂Fx/∂y
-        diffXz = diff(funcs[idx], z)  # ∂Fx/∂z
-        diffYx = diff(funcs[idx+1], x)  # ∂Fy/∂x
-        diffYz = diff(funcs[idx+1], z)  # ∂Fy/∂z
-        diffZy = diff(funcs[idx+2], y)  # ∂Fz/∂y
-        diffZx = diff(funcs[idx+2], x)  # ∂Fz/∂x
+        diffXy = jacobian[0][1]  # ∂Fx/∂y
+        diffXz = jacobian[0][2]  # ∂Fx/∂z
+        diffYx = jacobian[1][0]  # ∂Fy/∂x
+        diffYz = jacobian[1][2]  # ∂Fy/∂z
+        diffZy = jacobian[2][1]  # ∂Fz/∂y
+        diffZx = jacobian[2][0]  # ∂Fz/∂x
 
         funcX = diffZy - diffYz
         funcY = diffXz - diffZx
         funcZ = diffYx - diffXy
 
-        wm.curl_x = str(funcX)
-        wm.curl_y = str(funcY)
-        wm.curl_z = str(funcZ)
-
-        # Lambdify Fx, Fy, Fz
-        funcX = lambdify(syms, funcX)
-        funcY = lambdify(syms, funcY)
-        funcZ = lambdify(syms, funcZ)
-
-        if wm.on_graph:
-            # Lambdify function
-            func = lambdify(syms, funcs[0])
+        if on_graph:
+            func = funcs[0]
         else:
             func = None
 
-        syms = [str(x) for x in syms]
+        return (func, (funcX, funcY, funcZ), syms, on_graph, (str(funcX), str(funcY), str(funcZ)))
+
+    @staticmethod
+    def build(result):
+        wm = bpy.context.window_manager
+        func, (funcX, funcY, funcZ), syms, on_graph, texts = result
+
+        wm.curl_x, wm.curl_y, wm.curl_z = texts
 
         nodes.create_vector_field(
-            func, funcX, funcY, funcZ, syms, wm.on_graph, wm.join_graph, wm.use_length, wm.color_flag, wm.color_min, wm.color_max, 20, 20, 50, 50)
+            func, funcX, funcY, funcZ, syms, on_graph, wm.join_graph, wm.use_length, wm.color_flag, wm.color_min, wm.color_max, 20, 20, 50, 50,
+            wm.seeding, wm.seed_spacing, wm.seed_count)
+
+    @staticmethod
+    def functions(wm):
+        if wm.on_graph:
+            return (wm.function, wm.functionx, wm.functiony, wm.functionz)
+        return (wm.functionx, wm.functiony, wm.functionz)
+
+    @node_limit_guard
+    def execute(self, context):
+        wm = context.window_manager
+
+        self.build(self.symbolic(self.functions(wm), wm.on_graph, background.no_report))
+
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        functions, on_graph = self.functions(wm), wm.on_graph
+
+        # Keep the UI responsive while sympy runs, build the field once it is done
+        background.submit(self.bl_label, lambda report: GN_OT_CreateCurlField.symbolic(
+            functions, on_graph, report), node_limit_report(self.bl_label, GN_OT_CreateCurlField.build))
 
         return {"FINISHED"}
 
@@ -409,25 +575,64 @@ class GN_OT_CreateVectorStream(bpy.types.Operator):
     def execute(self, context):
         wm = context.window_manager
 
-        # Parse expressions
-        funcX = parse_expr(wm.functionx, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
-        funcY = parse_expr(wm.functiony, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
-        funcZ = parse_expr(wm.functionz, transformations=(
-            standard_transformations + (implicit_multiplication_application,)))
+        functions = stream_functions(wm, False)
+        func, field, source = stream_field(functions, False)
 
-        # Instantiate symbolic (x, y, z)
-        x, y, z = symbols('x y z')
+        nodes.create_vector_stream(
+            None, field, wm.dt, wm.steps, wm.color_flag, wm.color_min,
+            wm.color_max, wm.limit, False, wm.integrator, wm.tolerance, wm.min_speed,
+            wm.max_length, wm.seeding, wm.seed_spacing, wm.seed_count,
+            wm.workers if wm.parallel else -1, source)
 
-        # Lambdify Fx, Fy, Fz
-        funcX = lambdify((x, y, z), funcX)
-        funcY = lambdify((x, y, z), funcY)
-        funcZ = lambdify((x, y, z), funcZ)
+        # Remember the expressions for update_stream, one per line
+        context.active_object['stream_functions'] = '\n'.join(functions)
 
-        nodes.create_vector_stream(
-            None, funcX, funcY, funcZ, wm.dt, wm.steps, wm.color_flag, wm.color_min,
-            wm.color_max, wm.limit, False)
+        return {"FINISHED"}
+
+
+class GN_OT_UpdateVectorStream(bpy.types.Operator):
+    """Integrate the active vector stream again with the current settings, only extending
+    or truncating the streams when just the step count changed"""
+
+    bl_idname = "mesh.gn_update_vector_stream"
+    bl_label = "Update Vector Stream"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        error = update_stream(context)
+        if error is not None:
+            self.report({'ERROR'}, error)
+            return {"CANCELLED"}
+
+        return {"FINISHED"}
+
+
+class GN_OT_CreateLiveStream(bpy.types.Operator):
+    """Create vector stream from < Fx(x,y,z), Fy(x,y,z), Fz(x,y,z) > integrated by geometry
+    nodes, following the seed mesh and modifier inputs live (Blender 4.0+)"""
+
+    bl_idname = "mesh.gn_create_live_stream"
+    bl_label = "Create Live Vector Stream"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @node_limit_guard
+    def execute(self, context):
+        wm = context.window_manager
+
+        if bpy.app.version < (4, 0, 0):
+            self.report({'ERROR'}, "Live vector streams need the repeat zone of Blender 4.0+")
+            return {"CANCELLED"}
+
+        # Parse expression
+        funcs, syms = parse_functions(
+            [wm.functionx, wm.functiony, wm.functionz])
+
+        # Only the fixed step integrators are emitted as nodes
+        integrator = 'RK4' if wm.integrator in ('RK4', 'RK45') else 'EULER'
+
+        nodes.create_live_stream(
+            *funcs, syms, wm.dt, wm.steps, wm.limit, integrator, wm.color_flag,
+            wm.color_min, wm.color_max, wm.seeding, wm.seed_spacing, wm.seed_count)
 
         return {"FINISHED"}
 
@@ -439,6 +644,7 @@ class GN_OT_CreateSurface(bpy.types.Operator):
     bl_idname = "mesh.gn_create_surface"
     bl_label = "Create Parametric Surface"
 
+    @node_limit_guard
     def execute(self, context):
         wm = context.window_manager
 
@@ -451,6 +657,82 @@ class GN_OT_CreateSurface(bpy.types.Operator):
         return {"FINISHED"}
 
 
+class GN_OT_CreateBatch(bpy.types.Operator):
+    """Create every graph listed in a text block or a JSON, CSV or plain text file
+    as a single undo step"""
+
+    bl_idname = "mesh.gn_create_batch"
+    bl_label = "Create Batch"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        wm = context.window_manager
+
+        try:
+            specs = batch.load_specs(wm.batch_source)
+        except (OSError, ValueError, KeyError) as error:
+            self.report({'ERROR'}, f"Could not read {wm.batch_source}: {error}")
+            return {"CANCELLED"}
+
+        built, failures = batch.build_all(specs, wm.batch_spacing)
+
+        for i, error in failures:
+            self.report({'WARNING'}, f"Batch spec {i} failed: {error}")
+        if failures:
+            self.report({'WARNING'}, f"Built {built} of {len(specs)} graphs")
+        else:
+            self.report({'INFO'}, f"Built {built} graphs")
+
+        return {"FINISHED"}
+
+
+class GN_OT_EstimateCost(bpy.types.Operator):
+    """Estimate the nodes, links and per-vertex operations the expression compiles to"""
+
+    bl_idname = "mesh.gn_estimate_cost"
+    bl_label = "Estimate Cost"
+
+    def execute(self, context):
+        wm = context.window_manager
+
+        # Parse expression
+        funcs, syms = parse_functions([wm.function])
+
+        try:
+            nodes.prepare_expression(*funcs, syms)
+        except simplify.NodeLimitError as error:
+            self.report({'WARNING'}, str(error))
+            return {"FINISHED"}
+
+        self.report({'INFO'}, wm.cost_report)
+
+        return {"FINISHED"}
+
+
+class GN_OT_CancelJobs(bpy.types.Operator):
+    """Cancel the symbolic work running in the background"""
+
+    bl_idname = "mesh.gn_cancel_jobs"
+    bl_label = "Cancel"
+
+    def execute(self, context):
+        background.cancel_all()
+
+        return {"FINISHED"}
+
+
+class GN_OT_ClearJobErrors(bpy.types.Operator):
+    """Clear the errors of failed background work from the panel"""
+
+    bl_idname = "mesh.gn_clear_job_errors"
+    bl_label = "Clear Errors"
+
+    def execute(self, context):
+        background.failures.clear()
+
+        return {"FINISHED"}
+
+
 class GN_PT_Panel(bpy.types.Panel):
     """Create a panel in the shader editor tool shelf"""
 
@@ -461,7 +743,23 @@ class GN_PT_Panel(bpy.types.Panel):
     bl_category = "Graph"
 
     def draw(self, context):
-        return
+        layout = self.layout
+
+        # Symbolic work running in the background
+        for job in background.jobs:
+            row = layout.row(align=True)
+            row.label(text=job.status(), icon="TIME")
+        if background.jobs:
+            row = layout.row(align=True)
+            row.operator("mesh.gn_cancel_jobs", icon="CANCEL")
+
+        # Background work that failed, kept until cleared
+        for failure in background.failures:
+            row = layout.row(align=True)
+            row.label(text=failure, icon="ERROR")
+        if background.failures:
+            row = layout.row(align=True)
+            row.operator("mesh.gn_clear_job_errors", icon="X")
 
 
 class GN_PT_CreateGraphSettingsPanel(bpy.types.Panel):
@@ -480,6 +778,11 @@ class GN_PT_CreateGraphSettingsPanel(bpy.types.Panel):
         layout = self.layout
         wm = context.window_manager
 
+        row = layout.row(align=True)
+        row.prop(wm, "simplify_budget")
+        row = layout.row(align=True)
+        row.label(text=f"Simplified: {wm.simplify_report}")
+
         if bpy.context.active_object and 'Graph' in bpy.context.active_object.name:
             slice_mod = bpy.context.active_object.modifiers.get(
                 "Slice")
@@ -741,6 +1044,14 @@ class GN_PT_CreateUtilitiesPanel(bpy.types.Panel):
         row.operator("mesh.gn_create_slice",
                      icon="FILE_REFRESH", text="Plane Slice")
 
+        row = layout.row(align=True)
+        row.operator("mesh.gn_create_batch",
+                     icon="FILE_REFRESH", text="Create Batch")
+
+        row = layout.row(align=True)
+        row.prop(wm, "batch_source", text="Source")
+        row.prop(wm, "batch_spacing", text="Spacing")
+
 
 class GN_PT_CreateCurvePanel(bpy.types.Panel):
     """Create curve sub panel"""
@@ -811,6 +1122,14 @@ class GN_PT_CreateGraphPanel(bpy.types.Panel):
         row = layout.row(align=True)
         row.prop(wm, "function", text='f(x, y, z)')
 
+        row = layout.row(align=True)
+        row.operator("mesh.gn_estimate_cost", icon="INFO", text="Estimate Cost")
+        row.label(text=wm.cost_report)
+
+        row = layout.row(align=True)
+        row.prop(wm, "node_limit")
+        row.prop(wm, "node_limit_action", text="")
+
         row = layout.row(align=True)
         row.prop(wm, "join_graph")
         row.prop(wm, "gradient_dir", text="Descent")
@@ -864,6 +1183,15 @@ class GN_PT_CreateVectorPanel(bpy.types.Panel):
         row.operator("mesh.gn_create_vector_stream",
                      icon="FILE_REFRESH", text="Create Vector Stream")
 
+        row = layout.row(align=True)
+        row.operator("mesh.gn_update_vector_stream",
+                     icon="FILE_REFRESH", text="Update Vector Stream")
+        row.prop(wm, "live_streams", text="Live")
+
+        row = layout.row(align=True)
+        row.operator("mesh.gn_create_live_stream",
+                     icon="FILE_REFRESH", text="Create Live Vector Stream")
+
         row = layout.row(align=True)
         row.operator("mesh.gn_create_curl_field",
                      icon="FILE_REFRESH", text="Create Curl Vector Field")
@@ -875,6 +1203,23 @@ class GN_PT_CreateVectorPanel(bpy.types.Panel):
         row.prop(wm, "steps")
         row.prop(wm, "limit")
 
+        row = layout.row(align=True)
+        row.prop(wm, "integrator", text="")
+        row.prop(wm, "tolerance")
+
+        row = layout.row(align=True)
+        row.prop(wm, "min_speed")
+        row.prop(wm, "max_length")
+
+        row = layout.row(align=True)
+        row.prop(wm, "seeding", text="")
+        row.prop(wm, "seed_spacing")
+        row.prop(wm, "seed_count")
+
+        row = layout.row(align=True)
+        row.prop(wm, "parallel")
+        row.prop(wm, "workers")
+
         row = layout.row(align=True)
         row.prop(wm, "color_flag", text="Use Color")
         row.prop(wm, "color_min")
@@ -937,8 +1282,14 @@ classes = (
     GN_OT_CreateGradientDescentAscent,
     GN_OT_CreateVectorField,
     GN_OT_CreateVectorStream,
+    GN_OT_UpdateVectorStream,
+    GN_OT_CreateLiveStream,
     GN_OT_CreateCurlField,
     GN_OT_CreateSurface,
+    GN_OT_CreateBatch,
+    GN_OT_EstimateCost,
+    GN_OT_CancelJobs,
+    GN_OT_ClearJobErrors,
     GN_PT_Panel,
     GN_PT_CreateGraphSettingsPanel,
     GN_PT_CreateUtilitiesPanel,
@@ -956,6 +1307,7 @@ def register():
         FloatProperty,
         IntProperty,
         BoolProperty,
+        EnumProperty,
         FloatVectorProperty
     )
 
@@ -1170,7 +1522,8 @@ def register():
         default=.1,
         description="dt",
         min=-1000,
-        max=1000
+        max=1000,
+        update=update_streams
     )
 
     WindowManager.steps = IntProperty(
@@ -1178,9 +1531,101 @@ def register():
         default=50,
         description="steps",
         min=1,
+        max=100000,
+        update=update_streams
+    )
+
+    WindowManager.integrator = EnumProperty(
+        name="Integrator",
+        items=[
+            ('EULER', "Euler", "Explicit Euler steps"),
+            ('RK4', "RK4", "Fourth order Runge-Kutta steps"),
+            ('RK45', "RK45", "Adaptive Dormand-Prince steps within the tolerance"),
+            ('MOMENTUM', "Momentum", "Heavy ball steps, for gradient descent/ascent"),
+            ('ADAM', "Adam", "Adam optimizer steps, for gradient descent/ascent")
+        ],
+        default='EULER',
+        description="Method advancing vector streams and gradient descent/ascent",
+        update=update_streams
+    )
+
+    WindowManager.tolerance = FloatProperty(
+        name="Tolerance",
+        default=1e-4,
+        description="Relative error allowed per step by the adaptive integrator",
+        min=1e-10,
+        max=1.0,
+        precision=6,
+        update=update_streams
+    )
+
+    WindowManager.min_speed = FloatProperty(
+        name="Min Speed",
+        default=1e-6,
+        description="Stop a stream once the field is slower than this (a sink or fixed point)",
+        min=0.0,
+        max=1000.0,
+        precision=6,
+        update=update_streams
+    )
+
+    WindowManager.max_length = FloatProperty(
+        name="Max Length",
+        default=0.0,
+        description="Stop a stream once it is longer than this, 0 for no limit",
+        min=0.0,
+        max=100000.0,
+        update=update_streams
+    )
+
+    WindowManager.seeding = EnumProperty(
+        name="Seeding",
+        items=[
+            ('GRID', "Grid", "Lattice of seeds one unit apart"),
+            ('POISSON', "Poisson Disk", "Random seeds at least the spacing apart"),
+            ('EVENLY_SPACED', "Evenly Spaced", "Streams the spacing apart (Jobard-Lefer), Poisson disk seeds for vector fields"),
+            ('MAGNITUDE', "Magnitude", "Seed count denser where the field is faster")
+        ],
+        default='GRID',
+        description="Where vector fields and streams start when no mesh is selected"
+    )
+
+    WindowManager.seed_spacing = FloatProperty(
+        name="Spacing",
+        default=1.0,
+        description="Distance between seeds or evenly spaced streams",
+        min=0.05,
+        max=100.0
+    )
+
+    WindowManager.seed_count = IntProperty(
+        name="Seeds",
+        default=200,
+        description="Number of seeds drawn by magnitude",
+        min=1,
         max=100000
     )
 
+    WindowManager.live_streams = BoolProperty(
+        name="Live Streams",
+        default=False,
+        description="Update the active vector stream as its settings change"
+    )
+
+    WindowManager.parallel = BoolProperty(
+        name="Parallel",
+        default=False,
+        description="Integrate streams in worker processes, worth it for large seed sets"
+    )
+
+    WindowManager.workers = IntProperty(
+        name="Workers",
+        default=0,
+        description="Worker processes integrating streams, 0 for one per core",
+        min=0,
+        max=256
+    )
+
     WindowManager.line_count = IntProperty(
         name="Count",
         default=11,
@@ -1189,12 +1634,65 @@ def register():
         max=10000
     )
 
+    WindowManager.simplify_budget = FloatProperty(
+        name="Simplify Budget",
+        default=0.0,
+        description="Seconds spent trying rewrites (expand, cancel, factor, trigsimp) that emit fewer nodes, 0 to disable",
+        min=0.0,
+        max=60.0
+    )
+
+    WindowManager.simplify_report = StringProperty(
+        name="Simplified",
+        default="",
+        description="Rewrite chosen for the last compiled expression and its node count"
+    )
+
+    WindowManager.node_limit = IntProperty(
+        name="Node Limit",
+        default=500,
+        description="Most nodes an expression may compile to, 0 for no limit",
+        min=0,
+        max=100000
+    )
+
+    WindowManager.node_limit_action = EnumProperty(
+        name="Over Limit",
+        items=[
+            ('ABORT', "Abort", "Build nothing and report the estimated cost"),
+            ('SIMPLIFY', "Simplify", "Search longer for a smaller rewrite, abort if it is still over the limit")
+        ],
+        default='ABORT',
+        description="What to do with an expression over the node limit"
+    )
+
+    WindowManager.cost_report = StringProperty(
+        name="Cost",
+        default="",
+        description="Estimated nodes, links and per-vertex operations of the last compiled expression"
+    )
+
+    WindowManager.batch_source = StringProperty(
+        name="Batch Source",
+        default="",
+        description="Text block name or path of a JSON, CSV or plain text file (one expression per line) listing the graphs to create"
+    )
+
+    WindowManager.batch_spacing = FloatProperty(
+        name="Batch Spacing",
+        default=25.0,
+        description="Distance between the graphs of a batch",
+        min=0.0,
+        max=1000.0
+    )
+
     WindowManager.limit = FloatProperty(
         name="Limit",
         default=100,
-        description="Set limit for vector values to avoid overflow",
+        description="Streams stop when they leave the box |x|, |y|, |z| <= limit, vector values are clipped to it",
         min=.001,
-        max=100000
+        max=100000,
+        update=update_streams
     )
 
     WindowManager.start_z = FloatProperty(
@@ -1248,6 +1746,13 @@ def register():
 def unregister():
     from bpy.types import WindowManager
 
+    background.unregister()
+    # Release the stream worker pool if streams were integrated. Importing the module
+    # replaced the proxy in the package, so look it up in sys.modules
+    module = sys.modules.get(__package__ + '.streamlines')
+    if module is not None:
+        module.shutdown()
+
     del WindowManager.mesh_or_curve
     del WindowManager.curvex
     del WindowManager.curvey
@@ -1259,9 +1764,15 @@ def unregister():
     del WindowManager.functionx
     del WindowManager.functiony
     del WindowManager.functionz
-    del WindowManager.curlx
-    del WindowManager.curly
-    del WindowManager.curlz
+    del WindowManager.curl_x
+    del WindowManager.curl_y
+    del WindowManager.curl_z
+    del WindowManager.diffx
+    del WindowManager.diffy
+    del WindowManager.diffz
+    del WindowManager.gradient_dir
+    del WindowManager.quadratic_approximation_function
+    del WindowManager.limit
     del WindowManager.tangent_plane_function
     del WindowManager.bool_x
     del WindowManager.bool_y
@@ -1275,6 +1786,23 @@ def unregister():
     del WindowManager.on_graph
     del WindowManager.dt
     del WindowManager.steps
+    del WindowManager.integrator
+    del WindowManager.tolerance
+    del WindowManager.min_speed
+    del WindowManager.max_length
+    del WindowManager.seeding
+    del WindowManager.seed_spacing
+    del WindowManager.seed_count
+    del WindowManager.live_streams
+    del WindowManager.parallel
+    del WindowManager.workers
+    del WindowManager.simplify_budget
+    del WindowManager.simplify_report
+    del WindowManager.node_limit
+    del WindowManager.node_limit_action
+    del WindowManager.cost_report
+    del WindowManager.batch_source
+    del WindowManager.batch_spacing
     del WindowManager.color_min
     del WindowManager.color_max
     del WindowManager.line_count
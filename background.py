@@ -0,0 +1,180 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bpy
+
+# Seconds between checks for finished jobs
+poll_interval = 0.1
+
+# Jobs that have been submitted and not applied or cancelled yet
+jobs = []
+
+# Messages of failed jobs, shown in the Graph panel until cleared
+failures = []
+max_failures = 5
+
+executor = None
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a worker when its job has been cancelled
+    """
+    pass
+
+
+class Job():
+    """
+    Symbolic work (parsing, differentiation, stringification) running in a worker thread.
+    The result is handed to apply on the main thread by a bpy.app.timers callback, so
+    the UI stays responsive while sympy runs. apply runs in the window and area the job
+    was submitted from
+    """
+
+    def __init__(self, label, work, apply):
+        global executor
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+
+        # Remembered by pointer, the window or area may be closed before the job ends
+        context = bpy.context
+        self.window = context.window.as_pointer() if context.window else None
+        self.area = context.area.as_pointer() if context.area else None
+
+        self.label = label
+        self.apply = apply
+        self.stage = "Waiting"
+        self.cancelled = False
+        self.start = time.perf_counter()
+        self.future = executor.submit(work, self.report)
+
+    def report(self, stage):
+        """
+        Update the stage shown in the status bar. Called by the worker between stages,
+        which is also where a cancelled job stops
+        """
+        if self.cancelled:
+            raise Cancelled()
+        self.stage = stage
+
+    def cancel(self):
+        # A stage that already started runs to completion, its result is dropped
+        self.cancelled = True
+        self.future.cancel()
+
+    def status(self):
+        return f"{self.label}: {self.stage} ({time.perf_counter() - self.start:.1f}s)"
+
+
+def no_report(stage):
+    """
+    Report callback for work run synchronously on the main thread
+    """
+    pass
+
+
+def job_context(job):
+    """
+    Window and area a job was submitted from, as keyword arguments for temp_override.
+    Falls back to the first window if that window has been closed
+    """
+    windows = bpy.context.window_manager.windows
+    for window in windows:
+        if window.as_pointer() == job.window:
+            for area in window.screen.areas:
+                if area.as_pointer() == job.area:
+                    return {'window': window, 'area': area}
+            return {'window': window}
+    return {'window': windows[0]} if len(windows) else {}
+
+
+def override(job):
+    """
+    Context manager running operators and bpy.context lookups in the job's window, timer
+    callbacks have no window of their own
+    """
+    if not hasattr(bpy.context, 'temp_override'):
+        return contextlib.nullcontext()
+    return bpy.context.temp_override(**job_context(job))
+
+
+def report(message, job=None):
+    """
+    Show the failure of a job (or of the build a job is applying, without job) in a
+    popup and in the Graph panel
+    """
+    failures.append(message)
+    del failures[:-max_failures]
+
+    def draw(menu, context):
+        menu.layout.label(text=message)
+
+    with override(job) if job is not None else contextlib.nullcontext():
+        if bpy.context.window is not None:
+            bpy.context.window_manager.popup_menu(draw, title="Graph", icon='ERROR')
+
+
+def set_status(text):
+    for window in bpy.context.window_manager.windows:
+        window.workspace.status_text_set(text)
+
+        # Redraw the Graph panel listing the jobs
+        for area in window.screen.areas:
+            if area.type == 'NODE_EDITOR':
+                area.tag_redraw()
+
+
+def poll():
+    """
+    Timer callback applying finished jobs on the main thread
+    """
+    for job in list(jobs):
+        if job.cancelled:
+            jobs.remove(job)
+        elif job.future.done():
+            jobs.remove(job)
+            error = job.future.exception()
+            if error is None:
+                # A failing build must not stop the timer from applying later jobs
+                try:
+                    with override(job):
+                        job.apply(job.future.result())
+                except Exception as failure:
+                    report(f"{job.label} failed: {failure}", job)
+            elif not isinstance(error, Cancelled):
+                report(f"{job.label} failed: {error}", job)
+
+    if not jobs:
+        set_status(None)
+        return None
+
+    set_status(" | ".join(job.status() for job in jobs) + " | Graph > Cancel to stop")
+    return poll_interval
+
+
+def submit(label, work, apply):
+    """
+    Run work(report) in the background and call apply(result) on the main thread once it
+    finishes. work must not touch bpy data
+    """
+    job = Job(label, work, apply)
+    jobs.append(job)
+    if not bpy.app.timers.is_registered(poll):
+        bpy.app.timers.register(poll, first_interval=poll_interval)
+    return job
+
+
+def cancel_all():
+    for job in jobs:
+        job.cancel()
+
+
+def unregister():
+    cancel_all()
+    jobs.clear()
+    failures.clear()
+    if bpy.app.timers.is_registered(poll):
+        bpy.app.timers.unregister(poll)
@@ -0,0 +1,139 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import csv
+import io
+import json
+import math
+import os
+
+import bpy
+
+from . import nodes, parse_functions, replace_symbols
+
+# Graph types a spec can ask for
+spec_types = ('graph', 'scatter', 'contour', 'vector_field', 'curve', 'surface')
+
+
+def load_specs(source):
+    """
+    Read graph specs from the name of a text block or the path of a file. JSON holds a
+    list of objects, CSV a header row naming the keys, anything else one expression per
+    line (blank lines and lines starting with '#' are skipped) graphed as f(x, y, z)
+    """
+    text = bpy.data.texts.get(source)
+    if text is not None:
+        name, content = text.name, text.as_string()
+    else:
+        name = bpy.path.abspath(source)
+        with open(name, encoding='utf-8') as file:
+            content = file.read()
+
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.json' or content.lstrip().startswith('['):
+        specs = json.loads(content)
+    elif extension == '.csv':
+        specs = [{key: value for key, value in row.items() if value}
+                 for row in csv.DictReader(io.StringIO(content))]
+    else:
+        specs = [{'type': 'graph', 'function': line.strip()}
+                 for line in content.splitlines()
+                 if line.strip() and not line.strip().startswith('#')]
+
+    for spec in specs:
+        spec.setdefault('type', 'graph')
+        if spec['type'] not in spec_types:
+            raise ValueError(f"Unknown graph type '{spec['type']}', expected one of {', '.join(spec_types)}")
+    return specs
+
+
+def color(spec, key, default):
+    value = spec.get(key)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        value = [float(channel) for channel in value.split()]
+    return tuple(value)
+
+
+def build(spec, wm):
+    """
+    Create the graph described by one spec, using the panel settings for any key it
+    leaves out
+    """
+    kind = spec['type']
+    color_flag = str(spec.get('color', wm.color_flag)).lower() not in ('0', 'false', 'no')
+    color_min = color(spec, 'color_min', wm.color_min)
+    color_max = color(spec, 'color_max', wm.color_max)
+
+    if kind in ('graph', 'scatter'):
+        funcs, syms = parse_functions([spec['function']])
+        nodes.create_graph(spec.get('name', "Scatter Graph" if kind == 'scatter' else "Graph"),
+                           *funcs, syms, 20, 20, 50, 50, kind == 'scatter', False, False,
+                           color_flag or kind == 'scatter', color_min, color_max, 0, 0, 0, None)
+
+    elif kind == 'contour':
+        funcs, syms = parse_functions([spec['function']])
+        nodes.create_contour(*funcs, syms, 20, 20, 50, 50, color_min, color_max)
+
+    elif kind == 'vector_field':
+        components = [spec['x'], spec['y'], spec['z']]
+        on_graph = 'function' in spec
+        if on_graph:
+            funcs, syms = parse_functions([spec['function']] + components)
+        else:
+            funcs, syms = parse_functions(components)
+            funcs.insert(0, None)
+
+        nodes.create_vector_field(*funcs, syms, on_graph, on_graph, wm.use_length,
+                                  color_flag, color_min, color_max, 20, 20, 50, 50,
+                                  wm.seeding, wm.seed_spacing, wm.seed_count)
+
+    elif kind == 'curve':
+        funcs = replace_symbols([spec['x'], spec['y'], spec['z']], ['t'])
+        funcs, syms = parse_functions(funcs)
+        nodes.create_curve(*funcs, syms, wm.mesh_or_curve, 60, 10)
+
+    else:
+        funcs = replace_symbols([spec['x'], spec['y'], spec['z']], ['u', 'v'])
+        funcs, syms = parse_functions(funcs)
+        nodes.create_surface(*funcs, syms, 50, 50)
+
+
+def build_all(specs, spacing=25.0):
+    """
+    Create every graph in specs, laid out on a square grid spacing units apart (a spec
+    may set its own 'location' offset). Parsed expressions, expression node groups and
+    materials are shared between the graphs. Returns (number built, failures) where
+    failures lists (index, error) of the specs that could not be built
+    """
+    wm = bpy.context.window_manager
+    columns = max(1, math.ceil(math.sqrt(len(specs))))
+    built, failures = 0, []
+
+    nodes.share_materials(True)
+    try:
+        for i, spec in enumerate(specs):
+            before = set(bpy.context.scene.objects)
+
+            # Vector fields are added to the active mesh, start each graph from nothing
+            bpy.context.view_layer.objects.active = None
+            try:
+                build(spec, wm)
+            except Exception as error:
+                failures.append((i, error))
+                continue
+            built += 1
+
+            # Move the new top level objects to their cell of the grid
+            offset = spec.get('location')
+            if offset is None:
+                offset = ((i % columns) * spacing, -(i // columns) * spacing, 0)
+            elif isinstance(offset, str):
+                offset = [float(coordinate) for coordinate in offset.split()]
+            for obj in set(bpy.context.scene.objects) - before:
+                if obj.parent is None:
+                    obj.location = [a + b for a, b in zip(obj.location, offset)]
+    finally:
+        nodes.share_materials(False)
+
+    return (built, failures)
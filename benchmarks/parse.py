@@ -0,0 +1,87 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+"""
+Check that the fast parser builds the same expressions as parse_expr (or leaves them to
+it) and time both on the same inputs
+
+    python benchmarks/parse.py
+"""
+
+import importlib.util
+import os
+import time
+
+from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
+
+transformations = standard_transformations + (implicit_multiplication_application,)
+
+# Expressions typed in to the panel, including implicit parameters next to coordinates
+inputs = (
+    'x**2 + y**2',
+    'sin(x)cos(y)',
+    '2(x + 1)(x - 1)',
+    '-x**2',
+    '2**-x',
+    'x**y**2',
+    '1.5e3x',
+    '.5x',
+    'mx+b',
+    'ax**2+bx+c',
+    'xy**2',
+    'mx**2',
+    '2xy**3',
+    'x**ab',
+    '-ax**2',
+    'sqrt(xy)',
+    'alpha x + beta',
+    'pi r**2',
+    '007',
+    '1.5.5',
+    'lambda',
+)
+
+# Parses of each input timed for the comparison
+repeat = 200
+
+
+def load_fastparse():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location('fastparse', os.path.join(root, 'fastparse.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    fastparse = load_fastparse()
+
+    mismatches = []
+    for text in inputs:
+        fast = fastparse.parse(text)
+        if fast is None:
+            continue
+        expected = parse_expr(text, transformations=transformations)
+        if fast != expected:
+            mismatches.append(f"{text!r}: {fast} != {expected}")
+
+    fast_inputs = [text for text in inputs if fastparse.parse(text) is not None]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in fast_inputs:
+            fastparse.parse(text)
+    fast_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in fast_inputs:
+            parse_expr(text, transformations=transformations)
+    slow_time = time.perf_counter() - start
+
+    count = repeat * len(fast_inputs)
+    print(f"fast path: {len(fast_inputs)} of {len(inputs)} inputs, "
+          f"{fast_time / count * 1e6:.1f} us vs parse_expr {slow_time / count * 1e6:.1f} us per parse")
+    assert not mismatches, "fast parser disagrees with parse_expr:\n" + "\n".join(mismatches)
+
+
+if __name__ == "__main__":
+    main()
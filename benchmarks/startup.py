@@ -0,0 +1,80 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+"""
+Import and register the addon outside of Blender, with a stand-in for bpy, and check
+that it stays within the time budget without importing sympy or numpy
+
+    python benchmarks/startup.py
+"""
+
+import importlib.util
+import os
+import sys
+import time
+import types
+
+# Seconds allowed for importing and registering the addon
+budget = 0.5
+
+# Modules that must only be imported once an operator runs
+deferred = ('sympy', 'numpy')
+
+
+class StubModule(types.ModuleType):
+    """
+    Module handing out an empty class for every name it is asked for
+    """
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = type(name, (), {})
+        setattr(self, name, value)
+        return value
+
+
+def property_stub(**settings):
+    return settings
+
+
+def stub_bpy():
+    bpy = types.ModuleType('bpy')
+    bpy.types = StubModule('bpy.types')
+    bpy.props = types.ModuleType('bpy.props')
+    for name in ('StringProperty', 'FloatProperty', 'IntProperty', 'BoolProperty',
+                 'EnumProperty', 'FloatVectorProperty'):
+        setattr(bpy.props, name, property_stub)
+    bpy.utils = types.SimpleNamespace(register_class=lambda c: None, unregister_class=lambda c: None)
+    bpy.app = types.SimpleNamespace(version=(4, 0, 0), timers=types.SimpleNamespace(
+        is_registered=lambda f: False, register=lambda f, **k: None, unregister=lambda f: None))
+    bpy.context = types.SimpleNamespace()
+    bpy.data = types.SimpleNamespace()
+
+    sys.modules['bpy'] = bpy
+    sys.modules['bpy.types'] = bpy.types
+    sys.modules['bpy.props'] = bpy.props
+
+
+def main():
+    stub_bpy()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(
+        'graph', os.path.join(root, '__init__.py'), submodule_search_locations=[root])
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules['graph'] = addon
+    spec.loader.exec_module(addon)
+    addon.register()
+    elapsed = time.perf_counter() - start
+
+    addon.unregister()
+
+    print(f"import and register: {elapsed * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    imported = [name for name in deferred if name in sys.modules]
+    assert not imported, f"imported during registration: {', '.join(imported)}"
+    assert elapsed < budget, f"registration took {elapsed:.3f} s, over the {budget} s budget"
+
+
+if __name__ == "__main__":
+    main()
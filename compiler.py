@@ -0,0 +1,427 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import operator
+from collections import Counter
+
+import sympy
+
+
+# sympy functions that map directly on to a single-input math node
+unary_operations = {
+    sympy.sin: 'SINE',
+    sympy.cos: 'COSINE',
+    sympy.tan: 'TANGENT',
+    sympy.asin: 'ARCSINE',
+    sympy.acos: 'ARCCOSINE',
+    sympy.atan: 'ARCTANGENT',
+    sympy.sinh: 'SINH',
+    sympy.cosh: 'COSH',
+    sympy.tanh: 'TANH',
+    sympy.exp: 'EXPONENT',
+    sympy.Abs: 'ABSOLUTE',
+    sympy.sign: 'SIGN',
+    sympy.floor: 'FLOOR',
+    sympy.ceiling: 'CEIL',
+    sympy.frac: 'FRACT',
+}
+
+# sympy functions that are the reciprocal of a supported function
+reciprocal_operations = {
+    sympy.sec: sympy.cos,
+    sympy.csc: sympy.sin,
+    sympy.cot: sympy.tan,
+}
+
+# Relationals that map on to a comparison math node, with whether the result is negated
+relational_operations = {
+    sympy.StrictLessThan: ('LESS_THAN', False),
+    sympy.StrictGreaterThan: ('GREATER_THAN', False),
+    sympy.LessThan: ('GREATER_THAN', True),
+    sympy.GreaterThan: ('LESS_THAN', True),
+}
+
+
+def operate(operation, *inputs):
+    """
+    Emit a math node through the first non scalar (NodeMath) input
+    """
+    for var in inputs:
+        if not (isinstance(var, float) or isinstance(var, int)):
+            return var.math_node(operation, *inputs)
+    raise ValueError(f"Cannot emit {operation} without a node input")
+
+
+def floored_modulo(a, b):
+    """
+    sympy's Mod, whose result takes the sign of b, through the floored modulo math node
+    where the backend has it and as a - b * floor(a / b) otherwise. The modulo math node
+    truncates like fmod
+    """
+    for var in (a, b):
+        if not (isinstance(var, float) or isinstance(var, int)):
+            if var.builder.backend.floored_modulo:
+                return var.math_node('FLOORED_MODULO', a, b)
+            return a - b * operate('FLOOR', a / b)
+    return float(sympy.Mod(a, b))
+
+
+def balanced(values, combine):
+    """
+    Combine values pairwise in to a balanced tree instead of a left-deep chain
+    """
+    while len(values) > 1:
+        paired = [combine(values[i], values[i + 1])
+                  for i in range(0, len(values) - 1, 2)]
+        if len(values) % 2:
+            paired.append(values[-1])
+        values = paired
+    return values[0]
+
+
+class NodeCompiler():
+    """
+    Compile sympy expressions directly in to Blender math nodes with a single walk
+    over the expression tree. Every compiled subtree is memoized, so subexpressions
+    shared within or between expressions are only emitted once
+    """
+
+    def __init__(self, syms, nodemath_syms):
+        self.symbols = dict(zip([str(sym) for sym in syms], nodemath_syms))
+        self.memo = {}
+
+    def compile(self, expr):
+        """
+        Compile a sympy expression, returning a NodeMath or a float for constant expressions
+        """
+        if expr in self.memo:
+            return self.memo[expr]
+
+        out = self.emit(expr)
+        self.memo[expr] = out
+        return out
+
+    def emit(self, expr):
+        # Constant subtrees are evaluated instead of emitted
+        if not expr.free_symbols:
+            return float(expr)
+
+        if expr.is_Symbol:
+            return self.symbols[expr.name]
+
+        if expr.is_Add:
+            out = self.emit_polynomial(expr)
+            if out is not None:
+                return out
+
+            # Merge negated terms in to a single subtraction
+            terms = [arg for arg in expr.args if not arg.could_extract_minus_sign()]
+            negated_terms = [-arg for arg in expr.args if arg.could_extract_minus_sign()]
+            if not terms:
+                return -self.compile(-expr)
+
+            out = balanced([self.compile(arg) for arg in terms], operator.add)
+            if negated_terms:
+                out = out - balanced([self.compile(arg) for arg in negated_terms], operator.add)
+            return out
+
+        if expr.is_Mul:
+            # Merge reciprocal factors in to a single division
+            numer = []
+            denom = []
+            for arg in expr.args:
+                if arg.is_Pow and arg.exp.could_extract_minus_sign():
+                    denom.append(arg.base ** -arg.exp)
+                else:
+                    numer.append(arg)
+
+            out = balanced([self.compile(arg) for arg in numer] or [1.0], operator.mul)
+            if denom:
+                out = out / balanced([self.compile(arg) for arg in denom], operator.mul)
+            return out
+
+        if expr.is_Pow:
+            return self.compile(expr.base) ** self.compile(expr.exp)
+
+        if expr.func in unary_operations:
+            return operate(unary_operations[expr.func], self.compile(expr.args[0]))
+
+        if expr.func in reciprocal_operations:
+            return 1.0 / self.compile(reciprocal_operations[expr.func](expr.args[0]))
+
+        if expr.func == sympy.log:
+            return operate('LOGARITHM', self.compile(expr.args[0]), float(sympy.E))
+
+        if expr.func == sympy.atan2:
+            return operate('ARCTAN2', self.compile(expr.args[0]), self.compile(expr.args[1]))
+
+        if expr.func == sympy.Mod:
+            return floored_modulo(self.compile(expr.args[0]), self.compile(expr.args[1]))
+
+        if expr.func in (sympy.Min, sympy.Max):
+            operation = 'MINIMUM' if expr.func == sympy.Min else 'MAXIMUM'
+            args = [self.compile(arg) for arg in expr.args]
+            return balanced(args, lambda a, b: operate(operation, a, b))
+
+        if expr.func == sympy.Piecewise:
+            return self.emit_piecewise(expr)
+
+        # Fall back to rewriting unsupported functions in terms of supported ones
+        for target in (sympy.exp, sympy.log, sympy.Piecewise):
+            rewritten = expr.rewrite(target)
+            if rewritten != expr:
+                return self.compile(rewritten)
+
+        raise ValueError(f"Unsupported expression: {expr}")
+
+    def emit_polynomial(self, expr):
+        """
+        Emit a sum that is a polynomial of degree two or more in one of its symbols in
+        Horner form, with a multiply-add node per step. Coefficients may depend on the
+        other symbols and are compiled (and Horner-ized) recursively.
+        Returns None if the expression is not such a polynomial
+        """
+        poly = None
+        for sym in sorted(expr.free_symbols, key=str):
+            candidate = expr.as_poly(sym)
+            if candidate is None or candidate.degree() < 2 or len(candidate.terms()) < 2:
+                continue
+            if poly is None or candidate.degree() > poly.degree():
+                poly = candidate
+
+        if poly is None:
+            return None
+
+        var = self.compile(poly.gen)
+        terms = poly.terms()
+
+        # Skip over missing degrees with a power of the variable so sparse polynomials
+        # stay as cheap as their expanded form
+        (degree,), coeff = terms[0]
+        out = self.compile(coeff)
+        for (next_degree,), coeff in terms[1:]:
+            out = operate('MULTIPLY_ADD', out, var ** (degree - next_degree), self.compile(coeff))
+            degree = next_degree
+
+        if degree:
+            out = out * var ** degree
+        return out
+
+    def emit_condition(self, cond):
+        """
+        Emit a boolean condition as a 0.0/1.0 valued node
+        """
+        if cond == sympy.true:
+            return 1.0
+        if cond == sympy.false:
+            return 0.0
+
+        if cond.func in relational_operations:
+            operation, negate = relational_operations[cond.func]
+            out = operate(operation, self.compile(cond.lhs), self.compile(cond.rhs))
+            return 1.0 - out if negate else out
+
+        if cond.func in (sympy.Eq, sympy.Ne):
+            out = operate('COMPARE', self.compile(cond.lhs), self.compile(cond.rhs), 0.0)
+            return 1.0 - out if cond.func == sympy.Ne else out
+
+        if cond.func == sympy.Not:
+            return 1.0 - self.emit_condition(cond.args[0])
+
+        if cond.func in (sympy.And, sympy.Or):
+            args = [self.emit_condition(arg) for arg in cond.args]
+            out = args[0]
+            for arg in args[1:]:
+                out = out * arg if cond.func == sympy.And else operate('MAXIMUM', out, arg)
+            return out
+
+        raise ValueError(f"Unsupported condition: {cond}")
+
+    def emit_piecewise(self, expr):
+        """
+        Emit a piecewise function as a chain of mixes from the last piece to the first
+        """
+        out = 0.0
+        for piece, cond in reversed(expr.args):
+            piece = self.compile(piece)
+            cond = self.emit_condition(cond)
+            if cond == 1.0:
+                out = piece
+            else:
+                out = out + cond * (piece - out)
+        return out
+
+
+# sympy functions that map directly on to a single-input vector math node
+vector_unary_operations = {
+    sympy.sin: 'SINE',
+    sympy.cos: 'COSINE',
+    sympy.tan: 'TANGENT',
+    sympy.Abs: 'ABSOLUTE',
+    sympy.floor: 'FLOOR',
+    sympy.ceiling: 'CEIL',
+    sympy.frac: 'FRACTION',
+}
+
+# sympy functions whose arguments can be paired lane by lane in to a vector math node
+vector_nary_operations = {
+    sympy.Add: 'ADD',
+    sympy.Mul: 'MULTIPLY',
+    sympy.Min: 'MINIMUM',
+    sympy.Max: 'MAXIMUM',
+}
+
+
+def scalar_cost(exprs):
+    """
+    Estimate the number of math nodes needed to compute the expressions, counting
+    subexpressions shared between them once
+    """
+    seen = set()
+    cost = 0
+    for expr in exprs:
+        for sub in sympy.preorder_traversal(expr):
+            if sub in seen or sub.is_Symbol or not sub.free_symbols:
+                continue
+            seen.add(sub)
+            if sub.is_Add or sub.is_Mul:
+                cost += len(sub.args) - 1
+            else:
+                cost += 1
+    return cost
+
+
+def vector_operate(operation, *inputs):
+    """
+    Emit a vector math node through the first non constant (NodeMath) input
+    """
+    for var in inputs:
+        if not (isinstance(var, float) or isinstance(var, int) or isinstance(var, tuple)):
+            return var.vector_math_node(operation, *inputs)
+    raise ValueError(f"Cannot emit {operation} without a node input")
+
+
+class VectorCompiler():
+    """
+    Compile the X, Y and Z component expressions of a vector in to a single vector
+    output. Operations applied lane by lane to all three components (<a*x, a*y, a*z>,
+    <sin(x), sin(y), sin(z)>, ...) are emitted as one vector math node instead of three
+    math nodes whenever that is estimated to need fewer nodes
+    """
+
+    def __init__(self, compiler, position=None, offsets=None):
+        # Scalar compiler used for lane invariant parts and gathered components
+        self.compiler = compiler
+        # Optional NodeMath holding the (x, y, z) vector the coordinate symbols come from
+        self.position = position
+        # Optional y offset used for the nodes of each gathered component
+        self.offsets = offsets
+        self.plans = {}
+        # Any NodeMath of the node group can emit nodes, constant fields have no symbols
+        self.emitter = next(iter(compiler.symbols.values()), position)
+        if self.emitter is None:
+            raise ValueError("Vector expressions need a symbol or the position as input")
+
+    def compile(self, lanes):
+        """
+        Compile a triple of sympy expressions, returning a NodeMath with a vector output
+        """
+        lanes = tuple(sympy.sympify(lane) for lane in lanes)
+        out = self.emit(self.plan(lanes)[1])
+
+        if isinstance(out, tuple):
+            return self.emitter.combine_xyz(*out)
+        if isinstance(out, float) or not out.is_vector():
+            return self.emitter.combine_xyz(out, out, out)
+        return out
+
+    def plan(self, lanes):
+        """
+        Choose how to compute a triple of lanes, returning (estimated cost, plan) where
+        plan is ('constant', values), ('broadcast', expr), ('position',),
+        ('gather', lanes) or ('fused', operation, child plans)
+        """
+        if lanes in self.plans:
+            return self.plans[lanes]
+
+        if all(not lane.free_symbols for lane in lanes):
+            best = (0, ('constant', tuple(float(lane) for lane in lanes)))
+        elif lanes[0] == lanes[1] == lanes[2]:
+            best = (scalar_cost(lanes[:1]), ('broadcast', lanes[0]))
+        elif self.position is not None and lanes == sympy.symbols('x y z'):
+            best = (0, ('position',))
+        else:
+            best = (scalar_cost(lanes) + 1, ('gather', lanes))
+            for candidate in self.fused_candidates(lanes):
+                if candidate[0] <= best[0]:
+                    best = candidate
+
+        self.plans[lanes] = best
+        return best
+
+    def fused_candidates(self, lanes):
+        """
+        Yield (cost, plan) for every way of computing the lanes with a vector math node
+        at the root
+        """
+        funcs = set(lane.func for lane in lanes)
+
+        # Same single-input function on every lane
+        if len(funcs) == 1 and lanes[0].func in vector_unary_operations:
+            cost, child = self.plan(tuple(lane.args[0] for lane in lanes))
+            yield (cost + 1, ('fused', vector_unary_operations[lanes[0].func], [child]))
+
+        # Same cheap power on every lane
+        if len(funcs) == 1 and lanes[0].is_Pow and lanes[0].exp in (2, -1) and \
+                lanes[0].exp == lanes[1].exp == lanes[2].exp:
+            cost, child = self.plan(tuple(lane.base for lane in lanes))
+            if lanes[0].exp == 2:
+                yield (cost + 1, ('fused', 'MULTIPLY', [child, child]))
+            else:
+                yield (cost + 1, ('fused', 'DIVIDE', [('constant', (1.0, 1.0, 1.0)), child]))
+
+        for func in (sympy.Add, sympy.Mul):
+            if func not in funcs:
+                continue
+
+            # Factor out terms shared by every lane as a single broadcast scalar
+            lane_args = [Counter(lane.args if lane.func == func else (lane,))
+                         for lane in lanes]
+            common = lane_args[0] & lane_args[1] & lane_args[2]
+            if common:
+                shared = func(*common.elements())
+                rest = tuple(func(*(args - common).elements()) for args in lane_args)
+                cost, child = self.plan(rest)
+                yield (cost + scalar_cost([shared]) + 1,
+                       ('fused', vector_nary_operations[func], [('broadcast', shared), child]))
+
+        # Same n-ary function on every lane with arguments paired by position
+        if len(funcs) == 1 and lanes[0].func in vector_nary_operations and \
+                len(lanes[0].args) == len(lanes[1].args) == len(lanes[2].args):
+            costs, children = zip(*[self.plan(args) for args in zip(*[lane.args for lane in lanes])])
+            yield (sum(costs) + len(children) - 1,
+                   ('fused', vector_nary_operations[lanes[0].func], list(children)))
+
+    def emit(self, plan):
+        """
+        Emit the nodes for a plan, returning a NodeMath, an (x, y, z) tuple or a scalar
+        """
+        kind = plan[0]
+        if kind == 'constant':
+            return plan[1]
+        if kind == 'broadcast':
+            return self.compiler.compile(plan[1])
+        if kind == 'position':
+            return self.position
+        if kind == 'gather':
+            out = []
+            for i, lane in enumerate(plan[1]):
+                if self.offsets is not None:
+                    for sym in self.compiler.symbols.values():
+                        sym.offset_y = self.offsets[i]
+                out.append(self.compiler.compile(lane))
+            return self.emitter.combine_xyz(*out)
+
+        operation, children = plan[1], [self.emit(child) for child in plan[2]]
+        if operation in ('ADD', 'MULTIPLY', 'MINIMUM', 'MAXIMUM'):
+            return balanced(children, lambda a, b: vector_operate(operation, a, b))
+        return vector_operate(operation, *children)
@@ -0,0 +1,157 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import threading
+from collections import OrderedDict
+
+from sympy import diff, lambdify, srepr, symbols
+from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
+
+from . import fastparse
+
+# Transformations used to parse the expressions typed in to the panel
+default_transformations = standard_transformations + \
+    (implicit_multiplication_application,)
+
+
+class LRUCache():
+    """
+    Bounded mapping that evicts the least recently used entry and counts hits and
+    misses. Safe to share with the background worker thread
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, create):
+        """
+        Return the entry for key, calling create() to build it on a miss
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        # Build outside of the lock, two threads may build the same entry
+        value = create()
+
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries), 'maxsize': self.maxsize}
+
+
+# Process-wide cache shared by every operator
+cache = LRUCache()
+
+
+def parse(text, transformations=default_transformations):
+    """
+    Parse an expression string, returning (expression, names of its free symbols).
+    Plain arithmetic with the default transformations goes through the fast parser,
+    everything else through parse_expr
+    """
+    def create():
+        expr = None
+        if transformations == default_transformations:
+            expr = fastparse.parse(text)
+        if expr is None:
+            expr = parse_expr(text, transformations=transformations)
+        return (expr, frozenset(str(sym) for sym in expr.free_symbols))
+
+    return cache.get(('parse', text, transformations), create)
+
+
+def compile_function(expr, symbol_order=('x', 'y', 'z'), transformations=default_transformations):
+    """
+    Lambdify an expression (string or sympy expression) over the symbols in
+    symbol_order
+    """
+    symbol_order = tuple(symbol_order)
+
+    if isinstance(expr, str):
+        key = ('lambdify', expr, transformations, symbol_order)
+    else:
+        key = ('lambdify', srepr(expr), None, symbol_order)
+
+    def create():
+        parsed = parse(expr, transformations)[0] if isinstance(expr, str) else expr
+        return lambdify(symbols(symbol_order), parsed)
+
+    return cache.get(key, create)
+
+
+def compile_field(exprs, symbol_order=('x', 'y', 'z')):
+    """
+    Lambdify the components of a vector field (strings or sympy expressions) as a
+    single callable returning [Fx, Fy, Fz], sharing common subexpressions between them
+    """
+    symbol_order = tuple(symbol_order)
+    exprs = tuple(parse(expr)[0] if isinstance(expr, str) else expr for expr in exprs)
+
+    def create():
+        return lambdify(symbols(symbol_order), list(exprs), cse=True)
+
+    return cache.get(('field', srepr(exprs), symbol_order), create)
+
+
+def gradient(expr):
+    """
+    (∂F/∂x, ∂F/∂y, ∂F/∂z) of an expression (memoized)
+    """
+    def create():
+        return tuple(diff(expr, sym) for sym in symbols('x y z'))
+
+    return cache.get(('gradient', srepr(expr)), create)
+
+
+def jacobian(exprs):
+    """
+    Rows of partial derivatives of each component of a vector field (memoized)
+    """
+    return tuple(gradient(expr) for expr in exprs)
+
+
+def hessian(expr):
+    """
+    Matrix of second partial derivatives of an expression, built from the memoized
+    gradient. Mixed partials are only differentiated once
+    """
+    def create():
+        grad = gradient(expr)
+        xyz = symbols('x y z')
+        entries = {}
+        for i in range(3):
+            for j in range(i, 3):
+                entries[(i, j)] = entries[(j, i)] = diff(grad[i], xyz[j])
+        return tuple(tuple(entries[(i, j)] for j in range(3)) for i in range(3))
+
+    return cache.get(('hessian', srepr(expr)), create)
+
+
+def taylor_function(expr):
+    """
+    Single vectorized callable of (x, y, z) returning [F, gradient, Hessian], with
+    common subexpressions shared between all entries
+    """
+    def create():
+        entries = [expr, list(gradient(expr)), [list(row) for row in hessian(expr)]]
+        return lambdify(symbols('x y z'), entries, cse=True)
+
+    return cache.get(('taylor', srepr(expr)), create)
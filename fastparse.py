@@ -0,0 +1,209 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import builtins
+import keyword
+import re
+import unicodedata
+
+import sympy
+
+# Functions the fast path applies, anything else falls back to parse_expr
+functions = {
+    'sin': sympy.sin,
+    'cos': sympy.cos,
+    'tan': sympy.tan,
+    'asin': sympy.asin,
+    'acos': sympy.acos,
+    'atan': sympy.atan,
+    'sinh': sympy.sinh,
+    'cosh': sympy.cosh,
+    'tanh': sympy.tanh,
+    'sqrt': sympy.sqrt,
+    'exp': sympy.exp,
+    'log': sympy.log,
+}
+
+constants = {
+    'pi': sympy.pi,
+}
+
+# Names parse_expr resolves to sympy objects or builtins instead of symbols, or rejects
+reserved = set(sympy.__all__) | set(dir(builtins)) | set(keyword.kwlist)
+
+# Binding power of the binary operators, implicit multiplication binds like '*'
+binary_operations = {
+    '+': 10,
+    '-': 10,
+    '*': 20,
+    '/': 20,
+    '**': 40,
+}
+unary_binding = 30
+
+token_pattern = re.compile(
+    r'\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([A-Za-z_]\w*)|(\*\*|[-+*/(),]))')
+
+
+class Unsupported(Exception):
+    """
+    Raised when an expression is outside of the subset handled by the fast path
+    """
+    pass
+
+
+def tokenize(text):
+    """
+    Split an expression in to ('number' | 'name' | 'op', text) tokens
+    """
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = token_pattern.match(text, pos)
+        if match is None:
+            raise Unsupported(text[pos:])
+        pos = match.end()
+
+        number, name, op = match.groups()
+        if number is not None:
+            # Complex literals (2j), repeated decimal points (1.5.5) and integers with
+            # leading zeros (007) are left to parse_expr
+            if pos < len(text) and text[pos] in 'jJ.':
+                raise Unsupported(number)
+            if number.isdigit() and len(number) > 1 and number[0] == '0':
+                raise Unsupported(number)
+            tokens.append(('number', number))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', op))
+    tokens.append(('end', None))
+    return tokens
+
+
+def is_greek(name):
+    try:
+        unicodedata.lookup('GREEK SMALL LETTER ' + name)
+        return True
+    except KeyError:
+        return False
+
+
+class Parser():
+    """
+    Pratt parser for plain arithmetic with implicit multiplication, building the same
+    sympy expression parse_expr returns with the standard transformations and
+    implicit_multiplication_application
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, op):
+        if self.advance() != ('op', op):
+            raise Unsupported(op)
+
+    def parse(self):
+        expr = self.expression(0)
+        if self.peek()[0] != 'end':
+            raise Unsupported(self.peek()[1])
+        return expr
+
+    def expression(self, binding):
+        left = self.prefix()
+        while True:
+            kind, value = self.peek()
+            if kind == 'op' and value in binary_operations:
+                left_binding = binary_operations[value]
+                if left_binding <= binding:
+                    break
+                self.advance()
+
+                # '**' is right associative
+                right = self.expression(left_binding - 1 if value == '**' else left_binding)
+                if value == '+':
+                    left = left + right
+                elif value == '-':
+                    left = left - right
+                elif value == '*':
+                    left = left * right
+                elif value == '/':
+                    left = left / right
+                else:
+                    left = left ** right
+            elif kind in ('number', 'name') or (kind, value) == ('op', '('):
+                # Implicit multiplication (5x, 2(x + 1), (x + 1)(x - 1), sin(x)cos(y))
+                if binary_operations['*'] <= binding:
+                    break
+                left = left * self.expression(binary_operations['*'])
+            else:
+                break
+        return left
+
+    def prefix(self):
+        kind, value = self.advance()
+        if kind == 'number':
+            if value.isdigit():
+                return sympy.Integer(value)
+            return sympy.Float(value)
+        if kind == 'name':
+            return self.name(value)
+        if value == '(':
+            expr = self.expression(0)
+            self.expect(')')
+            return expr
+        if value == '-':
+            return -self.expression(unary_binding)
+        if value == '+':
+            return self.expression(unary_binding)
+        raise Unsupported(value)
+
+    def name(self, name):
+        if name in functions:
+            self.expect('(')
+            args = [self.expression(0)]
+            while self.peek() == ('op', ','):
+                self.advance()
+                args.append(self.expression(0))
+            self.expect(')')
+            try:
+                return functions[name](*args)
+            except TypeError:
+                raise Unsupported(name)
+
+        if name in constants:
+            return constants[name]
+
+        # Calls of unknown names and names sympy resolves to objects are left to parse_expr
+        if name in reserved or self.peek() == ('op', '(') or not name.isalpha() or not name.isascii():
+            raise Unsupported(name)
+
+        if len(name) == 1 or is_greek(name):
+            return sympy.Symbol(name)
+
+        # Multi-letter names are split in to single letter symbols multiplied implicitly
+        # (mx -> m*x). The letters after the first go back in to the token stream, so a
+        # following '**' only applies to the last one (mx**2 -> m*x**2)
+        if any(char in reserved for char in name):
+            raise Unsupported(name)
+        self.tokens[self.pos:self.pos] = [('name', char) for char in name[1:]]
+        return sympy.Symbol(name[0])
+
+
+def parse(text):
+    """
+    Parse an expression with the fast path, returning None if it needs parse_expr
+    """
+    try:
+        return Parser(text).parse()
+    except Unsupported:
+        return None
@@ -0,0 +1,533 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+from collections import Counter
+
+import numpy as np
+
+
+class NodeBuilder():
+    """
+    Backend-neutral expression IR. Nodes, default values and links are recorded in flat
+    tables and handed to a backend (Blender nodes, NumPy arrays or node counting) once an
+    output is needed. Identical nodes are only recorded once (hash-consing)
+
+    Every recorded value is a row index (ref). Node inputs are stored as refs (int) for
+    links or as float / (x, y, z) tuple default values. Rows with a node type of None are
+    named inputs (existing sockets, symbols) whose value is bound by the backend
+    """
+
+    __slots__ = ('backend', 'node_types', 'operations', 'inputs', 'locations',
+                 'vectors', 'refs')
+
+    # Node types with a vector output
+    vector_types = {'ShaderNodeVectorMath', 'ShaderNodeCombineXYZ'}
+
+    def __init__(self, backend):
+        self.backend = backend
+
+        # One row per value, inputs store their name in place of the operation
+        self.node_types = []
+        self.operations = []
+        self.inputs = []
+        self.locations = []
+        self.vectors = []
+
+        # Hash-consing table from node or input key to ref
+        self.refs = {}
+
+    def append(self, node_type, operation, inputs, location, vector):
+        self.node_types.append(node_type)
+        self.operations.append(operation)
+        self.inputs.append(inputs)
+        self.locations.append(location)
+        self.vectors.append(vector)
+        return len(self.node_types) - 1
+
+    def input(self, name, vector=False):
+        """
+        Register a named input value
+        """
+        key = ('input', name)
+        ref = self.refs.get(key)
+        if ref is None:
+            ref = self.append(None, name, (), None, vector)
+            self.refs[key] = ref
+        return ref
+
+    def socket(self, output):
+        """
+        Register an output socket that already exists in the node group as an input
+        """
+        ref = self.input(output.as_pointer(), output.type == 'VECTOR')
+        self.backend.bind(ref, output)
+        return ref
+
+    def node(self, node_type, operation, inputs, location=(0, 0), commutative=False):
+        """
+        Record a node, or return the ref of an identical node already recorded
+        """
+        inputs = tuple(inputs)
+        keys = [('ref', var) if isinstance(var, int) else ('value', var) for var in inputs]
+        if commutative:
+            keys.sort(key=str)
+        key = (node_type, operation, tuple(keys))
+
+        ref = self.refs.get(key)
+        if ref is None:
+            ref = self.append(node_type, operation, inputs, location,
+                              node_type in self.vector_types)
+            self.refs[key] = ref
+        return ref
+
+    def is_vector(self, ref):
+        """
+        Whether the value of a row is a vector
+        """
+        return self.vectors[ref]
+
+    def schedule(self, refs, done):
+        """
+        Rows reachable from refs that are not in done, in an order where every row comes
+        after its inputs. Rows only reference earlier rows, so sorting is enough
+        """
+        pending = set()
+        stack = [ref for ref in refs if ref not in done]
+        while stack:
+            ref = stack.pop()
+            if ref in pending:
+                continue
+            pending.add(ref)
+            for var in self.inputs[ref]:
+                if isinstance(var, int) and var not in done:
+                    stack.append(var)
+        return sorted(pending)
+
+    def output(self, ref):
+        """
+        Output of a row in the builder's backend
+        """
+        return self.backend.output(self, ref)
+
+
+class BlenderBackend():
+    """
+    Materialize the IR in to a Blender node group in a single pass. Nodes nothing
+    depends on are never created
+    """
+
+    def __init__(self, node_group):
+        self.node_group = node_group
+        self.sockets = {}
+
+        # Math nodes have a floored modulo from Blender 4.0 on. bpy is imported here so
+        # the other backends keep working without Blender
+        import bpy
+        operations = bpy.types.ShaderNodeMath.bl_rna.properties['operation'].enum_items
+        self.floored_modulo = 'FLOORED_MODULO' in operations.keys()
+
+    def bind(self, ref, socket):
+        self.sockets[ref] = socket
+
+    def materialize(self, builder, refs):
+        """
+        Create the nodes needed by refs, set their defaults and link their inputs
+        """
+        nodes = self.node_group.nodes
+        links = self.node_group.links
+        sockets = self.sockets
+
+        for ref in builder.schedule(refs, sockets):
+            node_type = builder.node_types[ref]
+            if node_type is None:
+                raise ValueError(f"No socket bound for input {builder.operations[ref]}")
+
+            node = nodes.new(node_type)
+            node.location = builder.locations[ref]
+
+            operation = builder.operations[ref]
+            if operation is not None:
+                node.operation = operation
+
+            if node_type == "ShaderNodeValue":
+                node.outputs[0].default_value = builder.inputs[ref][0]
+            else:
+                node_inputs = node.inputs
+                for i, var in enumerate(builder.inputs[ref]):
+                    if isinstance(var, int):
+                        # Freshly created inputs hold no links, skip the limit check
+                        links.new(sockets[var], node_inputs[i], verify_limits=False)
+                    else:
+                        node_inputs[i].default_value = var
+
+            sockets[ref] = node.outputs[0]
+
+    def output(self, builder, ref):
+        """
+        Output socket of a row, materializing the nodes it depends on first
+        """
+        if ref not in self.sockets:
+            self.materialize(builder, (ref,))
+        return self.sockets[ref]
+
+
+class CountingBackend():
+    """
+    Stand-in for the Blender backend that only counts the nodes and links that would be
+    created, and the arithmetic operations they run per vertex, so emission can be
+    measured without Blender
+    """
+
+    # Operations per vertex of each node type, vector math works on three components
+    operation_costs = {
+        'ShaderNodeMath': 1,
+        'ShaderNodeVectorMath': 3,
+        'ShaderNodeCombineXYZ': 0,
+        'ShaderNodeValue': 0,
+    }
+
+    floored_modulo = True
+
+    def __init__(self):
+        self.materialized = set()
+        self.nodes = Counter()
+        self.links = 0
+        self.operations = 0
+
+    def bind(self, ref, socket):
+        self.materialized.add(ref)
+
+    def materialize(self, builder, refs):
+        for ref in builder.schedule(refs, self.materialized):
+            node_type = builder.node_types[ref]
+            if node_type is not None:
+                self.nodes[(node_type, builder.operations[ref])] += 1
+                self.links += sum(isinstance(var, int) for var in builder.inputs[ref])
+                self.operations += self.operation_costs.get(node_type, 1)
+            self.materialized.add(ref)
+
+    def output(self, builder, ref):
+        self.materialize(builder, (ref,))
+        return ref
+
+    def total(self):
+        return sum(self.nodes.values())
+
+
+def safe_divide(a, b):
+    with np.errstate(all='ignore'):
+        return np.where(b != 0, a / np.where(b != 0, b, 1), 0.0)
+
+
+def safe_modulo(a, b):
+    with np.errstate(all='ignore'):
+        return np.where(b != 0, np.fmod(a, np.where(b != 0, b, 1)), 0.0)
+
+
+def safe_floored_modulo(a, b):
+    with np.errstate(all='ignore'):
+        return np.where(b != 0, a - b * np.floor(a / np.where(b != 0, b, 1)), 0.0)
+
+
+def safe_power(a, b):
+    with np.errstate(all='ignore'):
+        return np.where((a < 0) & (b != np.trunc(b)), 0.0, np.power(a, b))
+
+
+def safe_sqrt(a):
+    return np.sqrt(np.maximum(a, 0.0))
+
+
+def safe_inverse_sqrt(a):
+    with np.errstate(all='ignore'):
+        return np.where(a > 0, 1 / np.sqrt(np.where(a > 0, a, 1)), 0.0)
+
+
+def safe_log(a, b):
+    with np.errstate(all='ignore'):
+        valid = (a > 0) & (b > 0)
+        return np.where(valid, safe_divide(np.log(np.where(valid, a, 1)), np.log(np.where(valid, b, 2))), 0.0)
+
+
+# NumPy equivalents of the math node operations, following Blender's safe variants
+numpy_operations = {
+    'ADD': np.add,
+    'SUBTRACT': np.subtract,
+    'MULTIPLY': np.multiply,
+    'DIVIDE': safe_divide,
+    'MULTIPLY_ADD': lambda a, b, c: a * b + c,
+    'POWER': safe_power,
+    'LOGARITHM': safe_log,
+    'SQRT': safe_sqrt,
+    'INVERSE_SQRT': safe_inverse_sqrt,
+    'ABSOLUTE': np.abs,
+    'EXPONENT': np.exp,
+    'MINIMUM': np.minimum,
+    'MAXIMUM': np.maximum,
+    'LESS_THAN': lambda a, b: (a < b).astype(float),
+    'GREATER_THAN': lambda a, b: (a > b).astype(float),
+    'SIGN': np.sign,
+    'COMPARE': lambda a, b, c: (np.abs(a - b) <= np.maximum(c, np.finfo(np.float32).eps)).astype(float),
+    'ROUND': lambda a: np.floor(a + 0.5),
+    'FLOOR': np.floor,
+    'CEIL': np.ceil,
+    'TRUNC': np.trunc,
+    'FRACT': lambda a: a - np.floor(a),
+    'FRACTION': lambda a: a - np.floor(a),
+    'MODULO': safe_modulo,
+    'FLOORED_MODULO': safe_floored_modulo,
+    'SINE': np.sin,
+    'COSINE': np.cos,
+    'TANGENT': np.tan,
+    'SINH': np.sinh,
+    'COSH': np.cosh,
+    'TANH': np.tanh,
+    'ARCSINE': lambda a: np.arcsin(np.clip(a, -1.0, 1.0)),
+    'ARCCOSINE': lambda a: np.arccos(np.clip(a, -1.0, 1.0)),
+    'ARCTANGENT': np.arctan,
+    'ARCTAN2': np.arctan2,
+}
+
+
+class NumpyBackend():
+    """
+    Evaluate the IR over arrays. Scalars are arrays of shape (n,) and vectors arrays of
+    shape (n, 3); inputs are bound by ref or by input name
+    """
+
+    floored_modulo = True
+
+    def __init__(self, values=None):
+        self.values = {} if values is None else dict(values)
+        self.results = {}
+
+    def bind(self, ref, value):
+        self.values[ref] = value
+
+    def evaluate(self, builder, refs):
+        results = self.results
+        for ref in builder.schedule(refs, results):
+            node_type = builder.node_types[ref]
+            if node_type is None:
+                name = builder.operations[ref]
+                if ref in self.values:
+                    results[ref] = np.asarray(self.values[ref])
+                elif name in self.values:
+                    results[ref] = np.asarray(self.values[name])
+                else:
+                    raise ValueError(f"No value bound for input {name}")
+                continue
+
+            vector = builder.vectors[ref]
+            args = []
+            for var in builder.inputs[ref]:
+                if isinstance(var, int):
+                    value = results[var]
+                    # Implicit conversions between float and vector sockets
+                    if vector and node_type != "ShaderNodeCombineXYZ" and not builder.vectors[var]:
+                        value = value[..., None]
+                    elif not vector and builder.vectors[var]:
+                        value = value.mean(axis=-1)
+                    args.append(value)
+                else:
+                    args.append(np.asarray(var))
+
+            if node_type == "ShaderNodeValue":
+                results[ref] = args[0]
+            elif node_type == "ShaderNodeCombineXYZ":
+                results[ref] = np.stack(np.broadcast_arrays(*args), axis=-1)
+            else:
+                results[ref] = numpy_operations[builder.operations[ref]](*args)
+
+    def output(self, builder, ref):
+        """
+        Array value of a row, evaluating the rows it depends on first
+        """
+        if ref not in self.results:
+            self.evaluate(builder, (ref,))
+        return self.results[ref]
+
+
+class NodeMath():
+    """
+    NodeMath class that overloads common math expressions in order to programmatically
+    set up functions inside of Blender's node system
+
+    Math nodes are recorded in a NodeBuilder shared by every NodeMath created from the
+    same set of symbols, so identical subexpressions are only emitted once per node group
+    and the nodes are only created when an output socket is needed. Identities such as
+    x + 0 and x * 1 are folded away and common powers are replaced with cheaper operations
+    """
+
+    # Operations where the order of the inputs does not change the result
+    commutative_operations = {'ADD', 'MULTIPLY', 'MINIMUM', 'MAXIMUM'}
+
+    def __init__(self, output, builder, offset_x=0, offset_y=0):
+        self.output = output
+        self.builder = builder
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    @staticmethod
+    def fold_identity(operation, inputs):
+        """
+        Return the result of an operation that does not need a node (x + 0, x * 1, ...)
+        or None if a node has to be emitted
+        """
+        if len(inputs) != 2:
+            return None
+
+        a, b = inputs
+        a_scalar = isinstance(a, float) or isinstance(a, int)
+        b_scalar = isinstance(b, float) or isinstance(b, int)
+
+        if operation == 'ADD':
+            if a_scalar and a == 0:
+                return b
+            if b_scalar and b == 0:
+                return a
+        elif operation == 'SUBTRACT':
+            if b_scalar and b == 0:
+                return a
+        elif operation == 'MULTIPLY':
+            if (a_scalar and a == 0) or (b_scalar and b == 0):
+                return 0.0
+            if a_scalar and a == 1:
+                return b
+            if b_scalar and b == 1:
+                return a
+        elif operation == 'DIVIDE':
+            if b_scalar and b == 1:
+                return a
+        elif operation == 'POWER':
+            if b_scalar and b == 0:
+                return 1.0
+            if b_scalar and b == 1:
+                return a
+        return None
+
+    def math_node(self, operation, *inputs):
+        """
+        Record a math node with the given operation and inputs (NodeMath or scalar, in
+        socket order) or reuse an identical node already recorded for this node group
+        """
+        folded = self.fold_identity(operation, inputs)
+        if folded is not None:
+            return folded
+
+        return self.emit_node("ShaderNodeMath", operation, *inputs)
+
+    def wrap(self, output):
+        """
+        Wrap another output socket of the same node group, sharing this node builder
+        """
+        return NodeMath(self.builder.socket(output), self.builder, self.offset_x, self.offset_y)
+
+    def vector_math_node(self, operation, *inputs):
+        """
+        Record (or reuse) a vector math node. Inputs may be NodeMath, (x, y, z) tuples
+        or scalars, which are broadcast to all three components
+        """
+        inputs = [(float(var), float(var), float(var)) if isinstance(var, float) or isinstance(var, int)
+                  else var for var in inputs]
+        return self.emit_node("ShaderNodeVectorMath", operation, *inputs)
+
+    def combine_xyz(self, x, y, z):
+        """
+        Record (or reuse) a combine XYZ node gathering three scalar components
+        """
+        return self.emit_node("ShaderNodeCombineXYZ", None, x, y, z)
+
+    def emit_node(self, node_type, operation, *inputs):
+        """
+        Record a node of the given type and operation with its inputs linked or set as
+        default values, or reuse an identical node already recorded for this node group
+        """
+        values = []
+        for var in inputs:
+            if isinstance(var, NodeMath):
+                values.append(var.output)
+            elif isinstance(var, tuple):
+                values.append(tuple(float(v) for v in var))
+            else:
+                values.append(float(var))
+
+        output = self.builder.node(node_type, operation, values, (self.offset_x, self.offset_y),
+                                   operation in self.commutative_operations)
+        return NodeMath(output, self.builder, self.offset_x, self.offset_y)
+
+    def socket(self):
+        """
+        Output of this value in the builder's backend, materializing the nodes it
+        depends on (the output socket for the Blender backend)
+        """
+        return self.builder.output(self.output)
+
+    def is_vector(self):
+        return self.builder.is_vector(self.output)
+
+    def __add__(self, var):
+        return self.math_node('ADD', self, var)
+
+    def __radd__(self, var):
+        return self.math_node('ADD', var, self)
+
+    def __sub__(self, var):
+        return self.math_node('SUBTRACT', self, var)
+
+    def __rsub__(self, var):
+        return self.math_node('SUBTRACT', var, self)
+
+    def __mul__(self, var):
+        return self.math_node('MULTIPLY', self, var)
+
+    def __rmul__(self, var):
+        return self.math_node('MULTIPLY', var, self)
+
+    def __floordiv__(self, var):
+        div = self.math_node('DIVIDE', self, var)
+        return div.math_node('FLOOR', div)
+
+    def __rfloordiv__(self, var):
+        div = self.math_node('DIVIDE', var, self)
+        return div.math_node('FLOOR', div)
+
+    def __truediv__(self, var):
+        return self.math_node('DIVIDE', self, var)
+
+    def __rtruediv__(self, var):
+        return self.math_node('DIVIDE', var, self)
+
+    def __pow__(self, var):
+        # Replace powers that have a cheaper equivalent operation
+        if isinstance(var, float) or isinstance(var, int):
+            if var == 2:
+                return self.math_node('MULTIPLY', self, self)
+            if var == 0.5:
+                return self.math_node('SQRT', self)
+            if var == -0.5:
+                return self.math_node('INVERSE_SQRT', self)
+            if var == -1:
+                return self.math_node('DIVIDE', 1.0, self)
+
+        return self.math_node('POWER', self, var)
+
+    def __rpow__(self, var):
+        return self.math_node('POWER', var, self)
+
+    def __mod__(self, var):
+        return self.math_node('MODULO', self, var)
+
+    def __rmod__(self, var):
+        return self.math_node('MODULO', var, self)
+
+    def __neg__(self):
+        return self.math_node('MULTIPLY', self, -1.0)
+
+    def cos(self):
+        return self.math_node('COSINE', self)
+
+    def sin(self):
+        return self.math_node('SINE', self)
+
+    def sqrt(self):
+        return self.math_node('SQRT', self)
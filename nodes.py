@@ -1,281 +1,14 @@
 # Copyright (C) 2022, Francis LaBounty, All rights reserved.
 
+import hashlib
+
 import bpy
 import sympy
 import numpy as np
 
-
-class NodeMath():
-    """
-    NodeMath class that overloads common math expressions in order to programmatically
-    set up functions inside of Blender's node system
-    """
-
-    def __init__(self, output, node_group, offset_x=0, offset_y=0):
-        self.output = output
-        self.node_group = node_group
-        self.nodes = self.node_group.nodes
-        self.offset_x = offset_x
-        self.offset_y = offset_y
-
-    def __add__(self, var):
-        add_node = self.nodes.new("ShaderNodeMath")
-        add_node.operation = 'ADD'
-
-        self.node_group.links.new(self.output, add_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            add_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, add_node.inputs[1])
-
-        add_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(add_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __radd__(self, var):
-        add_node = self.nodes.new("ShaderNodeMath")
-        add_node.operation = 'ADD'
-
-        self.node_group.links.new(self.output, add_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            add_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, add_node.inputs[0])
-
-        add_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(add_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __sub__(self, var):
-        sub_node = self.nodes.new("ShaderNodeMath")
-        sub_node.operation = 'SUBTRACT'
-
-        self.node_group.links.new(self.output, sub_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            sub_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, sub_node.inputs[1])
-
-        sub_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(sub_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __rsub__(self, var):
-        sub_node = self.nodes.new("ShaderNodeMath")
-        sub_node.operation = 'ADD'
-
-        self.node_group.links.new(self.output, sub_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            sub_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, sub_node.inputs[0])
-
-        sub_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(sub_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __mul__(self, var):
-        mul_node = self.nodes.new("ShaderNodeMath")
-        mul_node.operation = 'MULTIPLY'
-
-        self.node_group.links.new(self.output, mul_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            mul_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, mul_node.inputs[1])
-
-        mul_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(mul_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __rmul__(self, var):
-        mul_node = self.nodes.new("ShaderNodeMath")
-        mul_node.operation = 'MULTIPLY'
-
-        self.node_group.links.new(self.output, mul_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            mul_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, mul_node.inputs[0])
-
-        mul_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(mul_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __floordiv__(self, var):
-        div_node = self.nodes.new("ShaderNodeMath")
-        div_node.operation = 'DIVIDE'
-
-        floor_node = self.nodes.new("ShaderNodeMath")
-        floor_node.operation = 'FLOOR'
-
-        self.node_group.links.new(self.output, div_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            div_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, div_node.inputs[1])
-
-        self.node_group.links.new(
-            div_node.outputs['Value'], floor_node.inputs[0])
-
-        div_node.location = (self.offset_x, self.offset_y)
-        floor_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(floor_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __rfloordiv__(self, var):
-        div_node = self.nodes.new("ShaderNodeMath")
-        div_node.operation = 'DIVIDE'
-
-        floor_node = self.nodes.new("ShaderNodeMath")
-        floor_node.operation = 'FLOOR'
-
-        self.node_group.links.new(self.output, div_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            div_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, div_node.inputs[0])
-
-        self.node_group.links.new(
-            div_node.outputs['Value'], floor_node.inputs[0])
-
-        div_node.location = (self.offset_x, self.offset_y)
-        floor_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(floor_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __truediv__(self, var):
-        div_node = self.nodes.new("ShaderNodeMath")
-        div_node.operation = 'DIVIDE'
-
-        self.node_group.links.new(self.output, div_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            div_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, div_node.inputs[1])
-
-        div_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(div_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __rtruediv__(self, var):
-        div_node = self.nodes.new("ShaderNodeMath")
-        div_node.operation = 'DIVIDE'
-
-        self.node_group.links.new(self.output, div_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            div_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, div_node.inputs[0])
-
-        div_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(div_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __pow__(self, var):
-        pow_node = self.nodes.new("ShaderNodeMath")
-        pow_node.operation = 'POWER'
-
-        self.node_group.links.new(self.output, pow_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            pow_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, pow_node.inputs[1])
-
-        pow_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(pow_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __rpow__(self, var):
-        pow_node = self.nodes.new("ShaderNodeMath")
-        pow_node.operation = 'POWER'
-
-        self.node_group.links.new(self.output, pow_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            pow_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, pow_node.inputs[0])
-
-        pow_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(pow_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __mod__(self, var):
-        mod_node = self.nodes.new("ShaderNodeMath")
-        mod_node.operation = 'MODULO'
-
-        self.node_group.links.new(self.output, mod_node.inputs[0])
-
-        if isinstance(var, float) or isinstance(var, int):
-            mod_node.inputs[1].default_value = var
-        else:
-            self.node_group.links.new(var.output, mod_node.inputs[1])
-
-        mod_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(mod_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __rmod__(self, var):
-        mod_node = self.nodes.new("ShaderNodeMath")
-        mod_node.operation = 'MODULO'
-
-        self.node_group.links.new(self.output, mod_node.inputs[1])
-
-        if isinstance(var, float) or isinstance(var, int):
-            mod_node.inputs[0].default_value = var
-        else:
-            self.node_group.links.new(var.output, mod_node.inputs[0])
-
-        mod_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(mod_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def __neg__(self):
-        neg_node = self.nodes.new("ShaderNodeMath")
-        neg_node.operation = 'MULTIPLY'
-
-        self.node_group.links.new(self.output, neg_node.inputs[0])
-
-        neg_node.inputs[1].default_value = -1.0
-
-        neg_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(neg_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def cos(self):
-        cos_node = self.nodes.new("ShaderNodeMath")
-        cos_node.operation = 'COSINE'
-
-        self.node_group.links.new(self.output, cos_node.inputs[0])
-
-        cos_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(cos_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def sin(self):
-        sin_node = self.nodes.new("ShaderNodeMath")
-        sin_node.operation = 'SINE'
-
-        self.node_group.links.new(self.output, sin_node.inputs[0])
-
-        sin_node.location = (self.offset_x, self.offset_y)
-
-        return NodeMath(sin_node.outputs['Value'], self.node_group, self.offset_x, self.offset_y)
-
-    def sqrt(self):
-        return self**0.5
+from . import expressions, simplify, streamlines
+from .compiler import NodeCompiler, VectorCompiler
+from .ir import BlenderBackend, NodeBuilder, NodeMath
 
 
 def sin(var):
@@ -308,39 +41,150 @@ def sqrt(var):
         return np.sqrt(var)
 
 
-def scalar_check(var, node_group, location=(0, 0)):
+def scalar_check(var, builder, location=(0, 0)):
     """
     Check if output is scalar and not an instance of NodeMath
     """
     if isinstance(var, float) or isinstance(var, int):
-        value_node = node_group.nodes.new("ShaderNodeValue")
-        value_node.outputs[0].default_value = var
-        value_node.location = location
-        return NodeMath(value_node.outputs['Value'], node_group)
+        return NodeMath(builder.node("ShaderNodeValue", None, (float(var),), location), builder)
     else:
         return var
 
 
-def instantiate_nodemath(syms, node_group, node_group_in, separate_xyz_node, offset_x=0, offset_y=0):
+def new_socket(node_group, in_out, socket_type, name):
+    """
+    Add an input ('INPUT') or output ('OUTPUT') socket to a node group, through the
+    interface of Blender 4 or the inputs and outputs of earlier versions
+    """
+    if hasattr(node_group, 'interface'):
+        return node_group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
+    if in_out == 'INPUT':
+        return node_group.inputs.new(socket_type, name)
+    return node_group.outputs.new(socket_type, name)
+
+
+def group_inputs(node_group):
+    """
+    Names of the input sockets of a node group
+    """
+    if hasattr(node_group, 'interface'):
+        return [item.name for item in node_group.interface.items_tree
+                if item.item_type == 'SOCKET' and item.in_out == 'INPUT']
+    return [socket.name for socket in node_group.inputs]
+
+
+def prepare_expression(exprs, syms, position=False):
     """
-    Instantiate NodeMath objects
+    Pick the rewrite of an expression with the fewest nodes and estimate its cost,
+    reporting both in the window manager. Raises NodeLimitError instead of returning
+    an expression over the node limit
     """
-    nodemath_syms = []
-    for i in range(len(syms)):
-        if syms[i] == 'x':
-            nodemath_syms.append(
-                NodeMath(separate_xyz_node.outputs['X'], node_group, offset_x, offset_y))
-        elif syms[i] == 'y':
-            nodemath_syms.append(
-                NodeMath(separate_xyz_node.outputs['Y'], node_group, offset_x, offset_y))
-        elif syms[i] == 'z':
-            nodemath_syms.append(
-                NodeMath(separate_xyz_node.outputs['Z'], node_group, offset_x, offset_y))
+    wm = bpy.context.window_manager
+
+    report = "as typed"
+    if wm.simplify_budget > 0:
+        exprs, report = simplify.simplest(exprs, syms, wm.simplify_budget, position)
+    cost = simplify.estimate(exprs, syms, position)
+
+    if wm.node_limit and cost['nodes'] > wm.node_limit and wm.node_limit_action == 'SIMPLIFY':
+        # Spend longer looking for a smaller form before giving up
+        exprs, more = simplify.simplest(exprs, syms, max(5 * wm.simplify_budget, 5.0), position)
+        report = f"{report}; {more}"
+        cost = simplify.estimate(exprs, syms, position)
+
+    wm.simplify_report = report
+    wm.cost_report = f"{cost['nodes']} nodes, {cost['links']} links, {cost['operations']} ops per vertex"
+
+    if wm.node_limit and cost['nodes'] > wm.node_limit:
+        raise simplify.NodeLimitError(
+            f"Expression needs {cost['nodes']} nodes, over the limit of {wm.node_limit}")
+    return exprs
+
+
+def expression_group(exprs, syms, position=False):
+    """
+    Get the node group computing a sympy expression, or the (X, Y, Z) components of a
+    vector, from one input per symbol. Groups are keyed by the canonical form of the
+    expression, so the nodes are only compiled the first time an expression is used and
+    every later graph of the same function references the same group
+    """
+    # Symbol order comes from a set, sort it so the key is stable between sessions
+    syms = sorted(syms)
+    vector = isinstance(exprs, tuple)
+    key = sympy.srepr((tuple(syms), exprs, position))
+    name = f"Expression {hashlib.sha1(key.encode()).hexdigest()[:16]}"
+
+    wm = bpy.context.window_manager
+    group = bpy.data.node_groups.get(name)
+    if group is not None and group.get('expression') == key:
+        wm.simplify_report = f"{group.get('simplify', 'as typed')} (reused)"
+        wm.cost_report = group.get('cost', "")
+        return group
+
+    # Simplify and check the node limit before anything is built
+    exprs = prepare_expression(exprs, syms, position)
+
+    group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    group['expression'] = key
+    group['simplify'] = wm.simplify_report
+    group['cost'] = wm.cost_report
+    nodes = group.nodes
+
+    # Interface, one float input per symbol
+    for sym in syms:
+        new_socket(group, 'INPUT', 'NodeSocketFloat', sym)
+    if position:
+        new_socket(group, 'INPUT', 'NodeSocketVector', 'Position')
+    if vector:
+        new_socket(group, 'OUTPUT', 'NodeSocketVector', 'Vector')
+    else:
+        new_socket(group, 'OUTPUT', 'NodeSocketFloat', 'Value')
+
+    group_in = nodes.new('NodeGroupInput')
+    group_in.location = (-400, 0)
+    group_out = nodes.new('NodeGroupOutput')
+    group_out.location = (400, 0)
+
+    # Instantiate NodeMath objects sharing a single node builder
+    builder = NodeBuilder(BlenderBackend(group))
+    nodemath_syms = [NodeMath(builder.socket(group_in.outputs[sym]), builder) for sym in syms]
+    compiler = NodeCompiler(syms, nodemath_syms)
+
+    # Populate Blender nodes, fusing operations shared by all three components of a
+    # vector in to vector math nodes
+    if vector:
+        position_sym = NodeMath(builder.socket(group_in.outputs['Position']), builder) if position else None
+        out = VectorCompiler(compiler, position_sym, (200, 0, -200)).compile(exprs)
+    else:
+        out = scalar_check(compiler.compile(exprs), builder)
+
+    group.links.new(out.socket(), group_out.inputs[0])
+    return group
+
+
+def instantiate_expression(group, syms, node_group, node_group_in, sockets, location=(0, 0)):
+    """
+    Add a group node referencing an expression group (see expression_group) to the node
+    group, linking x, y, z (and Position if given) from sockets and every other symbol
+    from a group input. Returns the output socket of the group node
+    """
+    group_node = node_group.nodes.new("GeometryNodeGroup")
+    group_node.node_tree = group
+    group_node.location = location
+
+    for sym in syms:
+        if sym in sockets:
+            node_group.links.new(sockets[sym], group_node.inputs[sym])
         else:
-            node_group.inputs.new('NodeSocketFloat', f"{syms[i]} variable")
-            nodemath_syms.append(NodeMath(
-                node_group_in.outputs[f"{syms[i]} variable"], node_group, offset_x, offset_y))
-    return nodemath_syms
+            if f"{sym} variable" not in group_inputs(node_group):
+                new_socket(node_group, 'INPUT', 'NodeSocketFloat', f"{sym} variable")
+            node_group.links.new(
+                node_group_in.outputs[f"{sym} variable"], group_node.inputs[sym])
+
+    if 'Position' in sockets:
+        node_group.links.new(sockets['Position'], group_node.inputs['Position'])
+
+    return group_node.outputs[0]
 
 
 def add_driver(source, target, prop, name, dataPath, index=-1, func='', id_type='WINDOWMANAGER', d_type=''):
@@ -386,8 +230,30 @@ def node_search(nodes, name):
     return None
 
 
+# Materials by (name, attribute, colors) while a batch shares them (see batch.py), None
+# gives every graph its own material
+material_cache = None
+
+
+def share_materials(shared):
+    """
+    Start (shared True) or stop sharing materials between the graphs created next
+    """
+    global material_cache
+    material_cache = {} if shared else None
+
+
 def create_material(mat_name, attribute_name, color_min, color_max, set_material_node):
+    key = (mat_name, attribute_name, tuple(color_min), tuple(color_max))
+    if material_cache is not None and key in material_cache:
+        mat = material_cache[key]
+        bpy.context.active_object.data.materials.append(mat)
+        set_material_node.inputs[2].default_value = mat
+        return
+
     mat = bpy.data.materials.new(name=mat_name)
+    if material_cache is not None:
+        material_cache[key] = mat
     mat.use_nodes = True
 
     mat_nodes = mat.node_tree.nodes
@@ -420,6 +286,10 @@ def create_graph(name, func, syms, size_x, size_y, x_dim, y_dim, is_scatter, ins
     a scalar output. F(x, y, z) -> R
     Leave out variable(s) from equation to graph lower dimensional functions
     """
+    # Compile the function first so an expression over the node limit builds nothing
+    if func is not None:
+        group = expression_group(func, syms)
+
     # Create object and link it to scene
     mesh = bpy.data.meshes.new(name)
     obj = bpy.data.objects.new(name, mesh)
@@ -614,14 +484,12 @@ def create_graph(name, func, syms, size_x, size_y, x_dim, y_dim, is_scatter, ins
     else:
         node_group_out.location = (1200, 0)
 
-    # Instantiate NodeMath objects
-    if syms is not None:
-        nodemath_syms = instantiate_nodemath(
-            syms, node_group, node_group_in, separate_xyz_node)
-
-    # Populate Blender nodes by running NodeMath (x, y, z) through function
+    # Reference the compiled function of (x, y, z) through a shared expression group
     if func is not None:
-        out = scalar_check(func(*nodemath_syms), node_group, (0, 0))
+        out = instantiate_expression(group, syms, node_group, node_group_in, {
+            'x': separate_xyz_node.outputs['X'],
+            'y': separate_xyz_node.outputs['Y'],
+            'z': separate_xyz_node.outputs['Z']}, (0, 0))
 
     # Link nodes
     if is_scatter:
@@ -652,7 +520,7 @@ def create_graph(name, func, syms, size_x, size_y, x_dim, y_dim, is_scatter, ins
                 separate_xyz_node.outputs['X'], combine_xyz_node.inputs['X'])
             node_group.links.new(
                 separate_xyz_node.outputs['Y'], combine_xyz_node.inputs['Y'])
-            node_group.links.new(out.output, combine_xyz_node.inputs['Z'])
+            node_group.links.new(out, combine_xyz_node.inputs['Z'])
 
         node_group.links.new(
             combine_xyz_node.outputs['Vector'], set_position_node.inputs['Position'])
@@ -693,8 +561,8 @@ def create_graph(name, func, syms, size_x, size_y, x_dim, y_dim, is_scatter, ins
             transform_node.outputs['Geometry'], capture_attribute_node.inputs['Geometry'])
 
         node_group.links.new(
-            out.output, attribute_statistic_node.inputs['Attribute'])
-        node_group.links.new(out.output, map_range_node.inputs[0])
+            out, attribute_statistic_node.inputs['Attribute'])
+        node_group.links.new(out, map_range_node.inputs[0])
 
         node_group.links.new(
             attribute_statistic_node.outputs['Min'], map_range_node.inputs[1])
@@ -762,18 +630,52 @@ def create_graph(name, func, syms, size_x, size_y, x_dim, y_dim, is_scatter, ins
                 post_transform_node.outputs['Geometry'], node_group_out.inputs['Geometry'])
 
 
-def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_graph=False, use_length=True, color_flag=True, color_min=None, color_max=None, size_x=0, size_y=0, x_dim=0, y_dim=0):
+def seed_points(seeding, field, extent, resolution, spacing=0.5, count=100):
+    """
+    Seeds filling the box |x|, |y|, |z| <= extent. 'GRID' is a lattice of resolution
+    points per axis, 'POISSON' (and 'EVENLY_SPACED', whose streams are placed by
+    streamlines.evenly_spaced) a Poisson disk sampling spacing apart, 'MAGNITUDE' count
+    points drawn more densely where the lambdified field is fast
+    """
+    if seeding == 'GRID':
+        x = np.linspace(-extent, extent, resolution, dtype=np.float32)
+        y = x.copy()
+        z = x.copy()
+        return np.vstack(np.meshgrid(x, y, z)).reshape(3, -1).T
+
+    low, high = (-extent,) * 3, (extent,) * 3
+    if seeding == 'MAGNITUDE':
+        return streamlines.magnitude_weighted(field, low, high, count)
+    return streamlines.poisson_disk(low, high, spacing)
+
+
+def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_graph=False, use_length=True, color_flag=True, color_min=None, color_max=None, size_x=0, size_y=0, x_dim=0, y_dim=0, seeding='GRID', spacing=1.0, count=500):
     """
     Function to create a vector field from v = < P, Q, R > where P, Q, R are functions mapping
     (x, y, z) to their respective outputs. R³ -> R³
+    Without a selected mesh the vectors are placed by seeding (see seed_points)
     """
+    # Compile the field first so an expression over the node limit builds nothing
+    vector_group = expression_group((funcX, funcY, funcZ), syms, True)
+    if on_graph:
+        try:
+            group = expression_group(func, syms)
+        except simplify.NodeLimitError:
+            # Do not leave the group of the field behind when the graph is over the limit
+            if vector_group.users == 0:
+                bpy.data.node_groups.remove(vector_group)
+            raise
+
     # Get geometry node group from active object
     if not on_graph and (bpy.context.active_object is None or bpy.context.active_object not in bpy.context.selected_objects or bpy.context.active_object.type != 'MESH'):
-        # create grid array
-        x = np.linspace(-5, 5, 11, dtype=np.float32)
-        y = x.copy()
-        z = x.copy()
-        grid = np.vstack(np.meshgrid(x, y, z)).reshape(3, -1).T
+        # Place the vectors, the field is only lambdified to weight seeds by magnitude.
+        # Parameters are taken at 0 like the modifier inputs they become
+        field = None
+        if seeding == 'MAGNITUDE':
+            parameters = {sympy.Symbol(sym): 0 for sym in syms if sym not in ('x', 'y', 'z')}
+            field = expressions.compile_field(
+                tuple(sympy.sympify(expr).subs(parameters) for expr in (funcX, funcY, funcZ)))
+        grid = seed_points(seeding, field, 5, 11, spacing, count)
 
         # Create empty mesh and add vertices
         mesh = bpy.data.meshes.new("vField Graph")
@@ -847,9 +749,6 @@ def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_gr
     separate_xyz_node = nodes.new("ShaderNodeSeparateXYZ")
     separate_xyz_node.location = (-200, 0)
 
-    combine_xyz_node = nodes.new("ShaderNodeCombineXYZ")
-    combine_xyz_node.location = (200, 0)
-
     transform_node = nodes.new("GeometryNodeTransform")
     if join_graph or on_graph:
         transform_node.name = "Secondary_Transform"
@@ -997,42 +896,19 @@ def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_gr
         else:
             node_group_out.location = (2000, 0)
 
-    # Instantiate NodeMath objects
-    nodemath_syms = instantiate_nodemath(
-        syms, node_group, node_group_in, separate_xyz_node, 0, 200)
-
-    # Populate and offset Blender nodes for Fx
-    outX = scalar_check(funcX(*nodemath_syms), node_group, (0, 200))
-
-    # Populate and offset Blender nodes for Fy
-    for sym in nodemath_syms:
-        sym.offset_y = 0
-    outY = scalar_check(funcY(*nodemath_syms), node_group, (0, 0))
-
-    # Populate and offset Blender nodes for Fz
-    for sym in nodemath_syms:
-        sym.offset_y = -200
-    outZ = scalar_check(funcZ(*nodemath_syms), node_group, (0, -200))
+    # Reference the compiled < Fx, Fy, Fz > through a shared expression group
+    out_vector = instantiate_expression(vector_group, syms, node_group, node_group_in, {
+        'x': separate_xyz_node.outputs['X'],
+        'y': separate_xyz_node.outputs['Y'],
+        'z': separate_xyz_node.outputs['Z'],
+        'Position': input_position_node.outputs['Position']}, (0, 200))
 
     if on_graph:
-        # Instantiate NodeMath objects
-        for i, sym in enumerate(nodemath_syms):
-            if sym.output == separate_xyz_node.outputs['X']:
-                nodemath_syms[i] = NodeMath(
-                    separate_xyz_graph_node.outputs['X'], node_group)
-            elif sym.output == separate_xyz_node.outputs['Y']:
-                nodemath_syms[i] = NodeMath(
-                    separate_xyz_graph_node.outputs['Y'], node_group)
-            elif sym.output == separate_xyz_node.outputs['Z']:
-                nodemath_syms[i] = NodeMath(
-                    separate_xyz_graph_node.outputs['Z'], node_group)
-
-        for sym in nodemath_syms:
-            sym.offset_y = -600
-            sym.offset_y = 250
-
-        # Populate and offset Blender nodes for F
-        out = scalar_check(func(*nodemath_syms), node_group, (-600, 250))
+        # Reference the compiled F through a shared expression group
+        out = instantiate_expression(group, syms, node_group, node_group_in, {
+            'x': separate_xyz_graph_node.outputs['X'],
+            'y': separate_xyz_graph_node.outputs['Y'],
+            'z': separate_xyz_graph_node.outputs['Z']}, (-600, 250))
 
     # Link nodes
     node_group.links.new(
@@ -1046,20 +922,20 @@ def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_gr
             separate_xyz_graph_node.outputs['X'], combine_xyz_graph_node.inputs['X'])
         node_group.links.new(
             separate_xyz_graph_node.outputs['Y'], combine_xyz_graph_node.inputs['Y'])
-        node_group.links.new(out.output, combine_xyz_graph_node.inputs['Z'])
+        node_group.links.new(out, combine_xyz_graph_node.inputs['Z'])
 
         node_group.links.new(
             mesh_grid_node.outputs['Mesh'], transform_graph_node.inputs['Geometry'])
         node_group.links.new(
             transform_graph_node.outputs['Geometry'], attribute_statistic_graph_node.inputs['Geometry'])
         node_group.links.new(
-            out.output, attribute_statistic_graph_node.inputs['Attribute'])
+            out, attribute_statistic_graph_node.inputs['Attribute'])
 
         node_group.links.new(
             length_vector_node.outputs['Value'], map_range_node.inputs[0])
 
         node_group.links.new(
-            out.output, map_range_graph_node.inputs[0])
+            out, map_range_graph_node.inputs[0])
         node_group.links.new(
             attribute_statistic_graph_node.outputs['Min'], map_range_graph_node.inputs[1])
         node_group.links.new(
@@ -1091,12 +967,8 @@ def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_gr
         node_group.links.new(
             node_group_in.outputs['Geometry'], transform_node.inputs['Geometry'])
 
-    node_group.links.new(outX.output, combine_xyz_node.inputs['X'])
-    node_group.links.new(outY.output, combine_xyz_node.inputs['Y'])
-    node_group.links.new(outZ.output, combine_xyz_node.inputs['Z'])
-
     node_group.links.new(
-        combine_xyz_node.outputs['Vector'], align_euler_to_vec_node.inputs['Vector'])
+        out_vector, align_euler_to_vec_node.inputs['Vector'])
 
     node_group.links.new(
         val_node.outputs['Value'], cylinder_node.inputs['Depth'])
@@ -1156,7 +1028,7 @@ def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_gr
 
     if color_flag or use_length:
         node_group.links.new(
-            combine_xyz_node.outputs['Vector'], length_vector_node.inputs['Vector'])
+            out_vector, length_vector_node.inputs['Vector'])
 
     if color_flag:
         node_group.links.new(
@@ -1241,21 +1113,135 @@ def create_vector_field(func, funcX, funcY, funcZ, syms, on_graph=False, join_gr
     bpy.context.object.modifiers['GeometryNodes']['Input_2'][2] = 1.0
 
 
-def create_vector_stream(func, funcX, funcY, funcZ, dt=0.1, steps=50, color_flag=True, color_min=None, color_max=None, limit=1000, gradient=False):
+def mesh_points(mesh):
+    """
+    (n, 3) array of the vertex positions of a mesh
+    """
+    verts = np.empty(len(mesh.vertices)*3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts)
+    return verts.reshape(-1, 3)
+
+
+def stream_trajectories(field, seeds, settings, workers=-1, source=None):
+    """
+    Integrate the seeds of a vector stream with settings (dt, steps, surface, direction,
+    integrator, tolerance, limit, min_speed, max_length). Given source, the sympy
+    ((P, Q, R), F) the field and surface were lambdified from, the trajectories are
+    cached so a new step count only extends or truncates them, or with workers >= 0
+    (0 for one per core) integrated in worker processes
+    """
+    if source is None:
+        return streamlines.integrate(field, seeds, *settings)
+
+    field_source = tuple(sympy.srepr(expr) for expr in source[0])
+    surface_source = sympy.srepr(source[1]) if settings[2] is not None else None
+    if workers < 0:
+        return streamlines.cached_integrate((field_source, surface_source), field, seeds, *settings)
+
+    # Workers lambdify the field again from its srepr
+    dt, steps, surface, *rest = settings
+    return streamlines.integrate_parallel(field_source, seeds, dt, steps, surface_source, *rest, workers)
+
+
+def write_streams(mesh, trajectories, limit):
+    """
+    Replace the geometry of a mesh with a chain of edges for every integrated stream with
+    at least two points, turned in to curves by the stream's geometry nodes. Each point
+    gets the float attributes stream_col (min-max scaled speed), stream_speed,
+    stream_curvature and stream_step (its step along the stream, the time in units of dt
+    for the fixed step integrators) and the integer stream_seed (index of its seed)
+    """
+    verts, color_fac, lengths = trajectories
+    nseeds, steps = verts.shape[:2]
+    mesh.clear_geometry()
+
+    # Points of the streams with at least two points, in stream order
+    valid = (np.arange(steps) < lengths[:, None]) & (lengths[:, None] > 1)
+    index = np.cumsum(valid).reshape(valid.shape) - 1
+    linked = valid[:, 1:]
+    edges = np.stack((index[:, :-1][linked], index[:, 1:][linked]), axis=1)
+
+    # Get magnitude of vectors and then min-max scale
+    # to the range 0-1 to encode magnitude in to color
+    norms = np.linalg.norm(np.clip(color_fac, -limit, limit), axis=2)[valid]
+    min = np.min(norms, initial=0.0)
+    max = np.max(norms, initial=0.0)
+    color = (norms - min)/(max - min) if max > min else np.zeros_like(norms)
+
+    mesh.vertices.add(int(valid.sum()))
+    mesh.vertices.foreach_set("co", np.ravel(verts[valid]))
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set("vertices", np.ravel(edges))
+
+    attributes = (
+        ("stream_col", 'FLOAT', color),
+        ("stream_speed", 'FLOAT', norms),
+        ("stream_curvature", 'FLOAT', streamlines.curvature(verts)[valid]),
+        ("stream_step", 'FLOAT', np.broadcast_to(np.arange(steps, dtype=np.float32), valid.shape)[valid]),
+        ("stream_seed", 'INT', np.broadcast_to(np.arange(nseeds)[:, None], valid.shape)[valid]),
+    )
+    for name, data_type, values in attributes:
+        attribute = mesh.attributes.get(name) or mesh.attributes.new(name, data_type, 'POINT')
+        attribute.data.foreach_set("value", np.ascontiguousarray(values, dtype=np.float32 if data_type == 'FLOAT' else np.int32))
+
+    mesh.update()
+
+
+def update_vector_stream(obj, func, field, dt=0.1, steps=50, limit=1000, integrator='EULER', tolerance=1e-4, min_speed=0.0, max_length=0.0, spacing=0.5, workers=-1, source=None):
+    """
+    Integrate a stream object made by create_vector_stream again with new settings and
+    rewrite its streams in place, keeping the object, its modifier and material. With
+    source the cached trajectories are extended or truncated when only the step count
+    changed (see stream_trajectories). Returns False if the seed object no longer exists
+    """
+    gradient = obj['stream_gradient'] or False
+    surface = func if gradient else None
+    direction = -1.0 if gradient == 'descent' else 1.0
+    settings = (dt, steps, surface, direction, integrator, tolerance, limit, min_speed, max_length or None)
+
+    # Evenly spaced streams are placed again, their seeds depend on each other
+    if obj['stream_seeding'] == 'EVENLY_SPACED':
+        trajectories = streamlines.evenly_spaced(field, (-2,) * 3, (2,) * 3, spacing, *settings)
+    else:
+        seed_obj = bpy.data.objects.get(obj['stream_seeds'])
+        if seed_obj is None:
+            return False
+        trajectories = stream_trajectories(field, mesh_points(seed_obj.data), settings, workers, source)
+
+    write_streams(obj.data, trajectories, limit)
+    return True
+
+
+def create_vector_stream(func, field, dt=0.1, steps=50, color_flag=True, color_min=None, color_max=None, limit=1000, gradient=False, integrator='EULER', tolerance=1e-4, min_speed=0.0, max_length=0.0, seeding='GRID', spacing=0.5, count=100, workers=-1, source=None):
     """
     Function to create a vector stream from v = < P, Q, R > where P, Q, R are functions mapping
     (x, y, z) to their respective outputs. R³ -> R³
+    field is the lambdified < P, Q, R > (see expressions.compile_field), func the lambdified
+    F(x, y, z) a gradient descent/ascent stream stays on. integrator names one of
+    streamlines.integrators, tolerance is the relative step error allowed by RK45.
+    Streams stop when they leave the box |x|, |y|, |z| <= limit, stop being finite, slow
+    below min_speed or grow longer than max_length (0 for no limit). Without a selected
+    mesh the streams start from seeding (see seed_points), 'EVENLY_SPACED' places
+    streams spacing apart. With workers >= 0 (0 for one per core) and source, the sympy
+    ((P, Q, R), F) the field and func were lambdified from, seeds are integrated in
+    worker processes
     """
     # Get active object
     context = bpy.context
 
+    # Integrate every seed at once, gradient streams stay on the graph of F
+    surface = func if gradient else None
+    direction = -1.0 if gradient == 'descent' else 1.0
+    settings = (dt, steps, surface, direction, integrator, tolerance, limit, min_speed, max_length or None)
+
     # Get geometry node group from active object
     if bpy.context.active_object is None or bpy.context.active_object not in bpy.context.selected_objects or bpy.context.active_object.type != 'MESH':  # and bpy.context.active_object.type == 'MESH'
-        # create grid array
-        x = np.linspace(-2, 2, 5, dtype=np.float32)
-        y = x.copy()
-        z = x.copy()
-        grid = np.vstack(np.meshgrid(x, y, z)).reshape(3, -1).T
+        if seeding == 'EVENLY_SPACED':
+            trajectories = streamlines.evenly_spaced(field, (-2,) * 3, (2,) * 3, spacing, *settings)
+            grid = trajectories[0][:, 0]
+        else:
+            grid = seed_points(seeding, field, 2, 5, spacing, count)
+            trajectories = stream_trajectories(field, grid, settings, workers, source)
 
         # Create empty mesh and add vertices
         mesh = bpy.data.meshes.new("vStream Graph")
@@ -1268,97 +1254,32 @@ def create_vector_stream(func, funcX, funcY, funcZ, dt=0.1, steps=50, color_flag
 
         # Set as active object
         bpy.context.view_layer.objects.active = obj
-
-    bpy.ops.object.mode_set(mode='OBJECT')
-    mesh = context.view_layer.objects.active.data
-    nverts = len(mesh.vertices)
-
-    # Get vertex array from mesh
-    verts = np.empty(nverts*3, dtype=np.float32)
-    mesh.vertices.foreach_get('co', verts)
-
-    # Collect list of return vectors
-    verts_out = []
-    if color_flag:
-        # Collect list of magnitude vectors
-        color_fac = []
-    for point in verts.reshape(-1, 3):
-        points = [point]
-
-        for _ in range(steps-1):
-            prev = points[-1]
-            func_eval = np.array([funcX(*prev), funcY(*prev), funcZ(*prev)])
-            if color_flag:
-                color_fac.append(func_eval)
-            if gradient == 'ascent':
-                point_eval = prev + dt * func_eval
-                point_eval[2] = func(*(point_eval))
-                points.append(point_eval)
-            elif gradient == 'descent':
-                point_eval = prev - dt * func_eval
-                point_eval[2] = func(*(point_eval))
-                points.append(point_eval)
-            else:
-                points.append(prev + dt * func_eval)
-
-        if color_flag:
-            color_fac.append(
-                np.array([funcX(*points[-1]), funcY(*points[-1]), funcZ(*points[-1])]))
-        verts_out.append(points)
-
-    # Convert verts and color_fac lists into numpy arrays and reshape to (-1, 3)
-    verts = np.asarray(verts_out, dtype=np.float32).reshape(-1, 3)
-    color_fac = np.asarray(color_fac, dtype=np.float32).reshape(-1, 3)
-
-    # Handle overflow and division by zero
-    np.nan_to_num(verts, copy=False)
-    np.clip(verts, -limit, limit, verts)
-    np.nan_to_num(color_fac, copy=False)
-    np.clip(color_fac, -limit, limit, color_fac)
-
-    if color_flag:
-        # Get magnitude of vectors and then min-max scale
-        # to the range 0-1 to encode magnitude in to color
-        norms = np.linalg.norm(color_fac, axis=1)
-        min = np.min(norms)
-        max = np.max(norms)
-        norms = (norms - min)/(max - min)
-
-    # Split verts and norms array and then set in to a bezier spline
-    bpy.ops.object.select_all(action='DESELECT')
-    for i in range(nverts):
-        cu = bpy.data.curves.new(name="poly", type="CURVE")
-        cu.dimensions = '3D'
-
-        spline = cu.splines.new('BEZIER')
-        spline.bezier_points.add(steps - 1)
-        spline.bezier_points.foreach_set(
-            "co", np.ravel(verts[i*steps:(i+1)*steps, ]))
-
-        if color_flag:
-            spline.bezier_points.foreach_set(
-                "radius", np.ravel(norms[i*steps:(i+1)*steps, ]))
-
-        if i == nverts-1:
-            obj = bpy.data.objects.new(f"vStream Graph", cu)
-        else:
-            obj = bpy.data.objects.new(f"vStream_{i}", cu)
-        context.collection.objects.link(obj)
-
-        # Select spline
-        obj.select_set(True)
-
-    # Join all spline in to one object
+        seed_obj = obj
+    else:
+        seeding = 'MESH'
+        seed_obj = context.view_layer.objects.active
+        if seed_obj.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        trajectories = stream_trajectories(field, mesh_points(seed_obj.data), settings, workers, source)
+
+    # Write the streams and their attributes in to one mesh datablock
+    stream_mesh = bpy.data.meshes.new("vStream Graph")
+    write_streams(stream_mesh, trajectories, limit)
+
+    obj = bpy.data.objects.new("vStream Graph", stream_mesh)
+    context.collection.objects.link(obj)
+
+    # Remember what the streams came from for update_vector_stream
+    obj['stream_seeds'] = seed_obj.name
+    obj['stream_gradient'] = gradient or ''
+    obj['stream_seeding'] = seeding
+
+    for selected in context.selected_objects:
+        selected.select_set(False)
+    obj.select_set(True)
     context.view_layer.objects.active = obj
-    bpy.ops.object.join()
-
-    # Set all spline handles to 'AUTOMATIC'
-    bpy.ops.object.editmode_toggle()
-    bpy.ops.curve.select_all(action='SELECT')
-    bpy.ops.curve.handle_type_set(type='AUTOMATIC')
-    bpy.ops.object.editmode_toggle()
 
-    # Add geometry nodes modifier to spline object
+    # Add geometry nodes modifier to stream object
     bpy.ops.object.modifier_add(type='NODES')
 
     # Get geometry node group
@@ -1368,55 +1289,46 @@ def create_vector_stream(func, funcX, funcY, funcZ, dt=0.1, steps=50, color_flag
 
     # Populate, position, and set default values for nodes
     node_group_in = nodes.get('Group Input')
-    node_group.inputs.new('NodeSocketFloat', 'Start')
-    node_group.inputs.new('NodeSocketFloat', 'End')
-    if color_flag:
-        node_group_in.location = (-600, 0)
-    else:
-        node_group_in.location = (-400, 0)
-
-    if color_flag:
-        radius_node = nodes.new("GeometryNodeInputRadius")
-        radius_node.location = (-600, -150)
-
-        capture_attribute_node = nodes.new("GeometryNodeCaptureAttribute")
-        capture_attribute_node.domain = 'POINT'
-        capture_attribute_node.location = (-400, 0)
+    new_socket(node_group, 'INPUT', 'NodeSocketFloat', 'Start')
+    end_socket = new_socket(node_group, 'INPUT', 'NodeSocketFloat', 'End')
+    end_socket.default_value = 1.0
+    node_group_in.location = (-600, 0)
 
-        set_material_node = nodes.new("GeometryNodeSetMaterial")
-        set_material_node.location = (600, 0)
+    # The streams already have a point per step, the chains of edges become poly
+    # curves keeping the stream attributes
+    mesh_to_curve_node = nodes.new("GeometryNodeMeshToCurve")
+    mesh_to_curve_node.location = (-400, 0)
 
     set_radius_node = nodes.new("GeometryNodeSetCurveRadius")
     set_radius_node.inputs[2].default_value = 0.2
     set_radius_node.location = (-200, -30)
 
-    resample_curve_node = nodes.new("GeometryNodeResampleCurve")
-    resample_curve_node.inputs[2].default_value = steps
-    resample_curve_node.location = (0, 0)
-
     circle_curve_node = nodes.new("GeometryNodeCurvePrimitiveCircle")
     circle_curve_node.inputs[0].default_value = 8
     circle_curve_node.inputs[4].default_value = 0.2
-    circle_curve_node.location = (200, -180)
+    circle_curve_node.location = (0, -180)
 
     trim_curve_node = nodes.new("GeometryNodeTrimCurve")
-    trim_curve_node.location = (200, 0)
+    trim_curve_node.location = (0, 0)
 
     curve_to_mesh_node = nodes.new("GeometryNodeCurveToMesh")
-    curve_to_mesh_node.location = (400, 0)
+    curve_to_mesh_node.location = (200, 0)
 
     node_group_out = nodes.get('Group Output')
     if color_flag:
-        node_group.outputs.new('NodeSocketFloat', 'Attribute')
-        node_group_out.location = (800, 0)
-    else:
+        set_material_node = nodes.new("GeometryNodeSetMaterial")
+        set_material_node.location = (400, 0)
         node_group_out.location = (600, 0)
+    else:
+        node_group_out.location = (400, 0)
 
     # Link nodes
     node_group.links.new(
-        set_radius_node.outputs['Curve'], resample_curve_node.inputs['Curve'])
+        node_group_in.outputs['Geometry'], mesh_to_curve_node.inputs['Mesh'])
+    node_group.links.new(
+        mesh_to_curve_node.outputs['Curve'], set_radius_node.inputs['Curve'])
     node_group.links.new(
-        resample_curve_node.outputs['Curve'], trim_curve_node.inputs['Curve'])
+        set_radius_node.outputs['Curve'], trim_curve_node.inputs['Curve'])
 
     node_group.links.new(
         trim_curve_node.outputs['Curve'], curve_to_mesh_node.inputs['Curve'])
@@ -1429,37 +1341,278 @@ def create_vector_stream(func, funcX, funcY, funcZ, dt=0.1, steps=50, color_flag
         node_group_in.outputs['End'], trim_curve_node.inputs['End'])
 
     if color_flag:
-        node_group.links.new(
-            node_group_in.outputs['Geometry'], capture_attribute_node.inputs['Geometry'])
-        node_group.links.new(
-            radius_node.outputs['Radius'], capture_attribute_node.inputs[2])
-
-        node_group.links.new(
-            capture_attribute_node.outputs['Geometry'], set_radius_node.inputs['Curve'])
-
-        node_group.links.new(
-            capture_attribute_node.outputs[2], node_group_out.inputs['Attribute'])
-
         node_group.links.new(
             curve_to_mesh_node.outputs['Mesh'], set_material_node.inputs['Geometry'])
         node_group.links.new(
             set_material_node.outputs['Geometry'], node_group_out.inputs['Geometry'])
 
-        # Name output attribute
-        context.object.modifiers['GeometryNodes']['Output_4_attribute_name'] = "stream_col"
-
-        # Set up material
+        # Set up material, reading the stream_col point attribute
         create_material("Stream_Mat", "stream_col", color_min,
                         color_max, set_material_node)
 
     else:
-        node_group.links.new(
-            node_group_in.outputs['Geometry'], set_radius_node.inputs['Curve'])
         node_group.links.new(
             curve_to_mesh_node.outputs['Mesh'], node_group_out.inputs['Geometry'])
 
-    # Set input (trim curve end) to 1.00
-    context.object.modifiers['GeometryNodes']['Input_3'] = 1.00
+    # Set input (trim curve end) to 1.00, its identifier is Input_3 before Blender 4 and
+    # Socket_N from then on
+    context.object.modifiers['GeometryNodes'][end_socket.identifier] = 1.00
+
+
+def create_live_stream(funcX, funcY, funcZ, syms, dt=0.1, steps=50, limit=1000, integrator='EULER', color_flag=True, color_min=None, color_max=None, seeding='GRID', spacing=0.5, count=100):
+    """
+    Function to create a vector stream from v = < P, Q, R > integrated by geometry nodes
+    (Blender 4 repeat zone) instead of Python, so the streams follow the seed points, dt,
+    steps and the parameter inputs live. The seed points are the vertices of the new
+    stream object's own mesh, copied from the selected mesh or placed by seeding (see
+    seed_points). Every iteration moves them by an Euler or RK4 ('RK4') step and adds
+    them to a trail, which is turned in to one curve per seed at the end. Points leaving
+    the box |x|, |y|, |z| <= limit are dropped
+    """
+    # Compile the field first so an expression over the node limit builds nothing
+    group = expression_group((funcX, funcY, funcZ), syms, True)
+
+    # Copy the seeds of the selected mesh instead of adding the modifier to it
+    context = bpy.context
+    if context.active_object is None or context.active_object not in context.selected_objects or context.active_object.type != 'MESH':
+        # Parameters are taken at 0 like the modifier inputs they become
+        field = None
+        if seeding == 'MAGNITUDE':
+            parameters = {sympy.Symbol(sym): 0 for sym in syms if sym not in ('x', 'y', 'z')}
+            field = expressions.compile_field(
+                tuple(sympy.sympify(expr).subs(parameters) for expr in (funcX, funcY, funcZ)))
+        grid = seed_points('POISSON' if seeding == 'EVENLY_SPACED' else seeding, field, 2, 5, spacing, count)
+    else:
+        if context.active_object.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        grid = mesh_points(context.active_object.data)
+
+    # Create empty mesh and add vertices
+    mesh = bpy.data.meshes.new("vStream Live Graph")
+    mesh.vertices.add(grid.shape[0])
+    mesh.vertices.foreach_set("co", np.ravel(grid))
+
+    # Create object and link it to scene
+    obj = bpy.data.objects.new("vStream Live Graph", mesh)
+    context.collection.objects.link(obj)
+
+    # Set as the only selected and active object
+    for selected in context.selected_objects:
+        selected.select_set(False)
+    obj.select_set(True)
+    context.view_layer.objects.active = obj
+
+    # Add geometry nodes modifier with a new node group
+    node_group = bpy.data.node_groups.new("vStream Live", 'GeometryNodeTree')
+    node_group.is_modifier = True
+    new_socket(node_group, 'INPUT', 'NodeSocketGeometry', 'Geometry')
+    new_socket(node_group, 'OUTPUT', 'NodeSocketGeometry', 'Geometry')
+    new_socket(node_group, 'INPUT', 'NodeSocketFloat', 'dt').default_value = dt
+    new_socket(node_group, 'INPUT', 'NodeSocketInt', 'Steps').default_value = steps
+    new_socket(node_group, 'INPUT', 'NodeSocketFloat', 'Limit').default_value = limit
+    obj.modifiers.new("GeometryNodes", 'NODES').node_group = node_group
+    nodes = node_group.nodes
+    links = node_group.links
+
+    # Populate, position, and set default values for nodes
+    node_group_in = nodes.new('NodeGroupInput')
+    node_group_in.location = (-1600, 0)
+
+    node_group_out = nodes.new('NodeGroupOutput')
+    node_group_out.location = (2200, 0)
+
+    mesh_to_points_node = nodes.new("GeometryNodeMeshToPoints")
+    mesh_to_points_node.location = (-1400, 0)
+
+    index_node = nodes.new("GeometryNodeInputIndex")
+    index_node.location = (-1400, -150)
+
+    store_seed_node = nodes.new("GeometryNodeStoreNamedAttribute")
+    store_seed_node.data_type = 'INT'
+    store_seed_node.inputs['Name'].default_value = "seed"
+    store_seed_node.location = (-1200, 0)
+
+    repeat_input_node = nodes.new("GeometryNodeRepeatInput")
+    repeat_input_node.location = (-1000, 0)
+    repeat_output_node = nodes.new("GeometryNodeRepeatOutput")
+    repeat_output_node.location = (1000, 0)
+    repeat_input_node.pair_with_output(repeat_output_node)
+    repeat_output_node.repeat_items.new('GEOMETRY', "Trail")
+    repeat_output_node.repeat_items.new('INT', "Step")
+
+    input_position_node = nodes.new("GeometryNodeInputPosition")
+    input_position_node.location = (-1000, -300)
+
+    def vector_math(operation, a, b=None, scale=None, location=(0, 0)):
+        node = nodes.new("ShaderNodeVectorMath")
+        node.operation = operation
+        node.location = location
+        links.new(a, node.inputs[0])
+        if b is not None:
+            links.new(b, node.inputs[1])
+        if scale is not None:
+            links.new(scale, node.inputs['Scale'])
+        return node.outputs['Vector'] if operation != 'LENGTH' else node.outputs['Value']
+
+    def math(operation, a, b, location=(0, 0)):
+        node = nodes.new("ShaderNodeMath")
+        node.operation = operation
+        node.location = location
+        for i, value in enumerate((a, b)):
+            if isinstance(value, float) or isinstance(value, int):
+                node.inputs[i].default_value = value
+            else:
+                links.new(value, node.inputs[i])
+        return node.outputs[0]
+
+    def velocity(position, location=(0, 0)):
+        # Reference the compiled < Fx, Fy, Fz > at position through the shared expression group
+        separate_xyz_node = nodes.new("ShaderNodeSeparateXYZ")
+        separate_xyz_node.location = (location[0] - 200, location[1])
+        links.new(position, separate_xyz_node.inputs['Vector'])
+        return instantiate_expression(group, syms, node_group, node_group_in, {
+            'x': separate_xyz_node.outputs['X'],
+            'y': separate_xyz_node.outputs['Y'],
+            'z': separate_xyz_node.outputs['Z'],
+            'Position': position}, location)
+
+    # Offset of one step
+    dt_socket = node_group_in.outputs['dt']
+    position = input_position_node.outputs['Position']
+    k1 = velocity(position, (-600, -300))
+    if integrator == 'RK4':
+        half_dt = math('MULTIPLY', dt_socket, 0.5, (-600, -600))
+        k2 = velocity(vector_math('ADD', position, vector_math('SCALE', k1, scale=half_dt, location=(-400, -450)), location=(-300, -450)), (0, -450))
+        k3 = velocity(vector_math('ADD', position, vector_math('SCALE', k2, scale=half_dt, location=(200, -600)), location=(300, -600)), (600, -600))
+        k4 = velocity(vector_math('ADD', position, vector_math('SCALE', k3, scale=dt_socket, location=(-400, -750)), location=(-300, -750)), (0, -750))
+        inner = vector_math('ADD', vector_math('ADD', k2, k3, location=(200, -300)), vector_math('ADD', k1, k4, location=(200, -750)), location=(400, -300))
+        total = vector_math('ADD', inner, vector_math('ADD', k2, k3, location=(400, -450)), location=(600, -300))
+        offset = vector_math('SCALE', total, scale=math('DIVIDE', dt_socket, 6.0, (400, -900)), location=(800, -300))
+    else:
+        offset = vector_math('SCALE', k1, scale=dt_socket, location=(-200, -300))
+
+    set_position_node = nodes.new("GeometryNodeSetPosition")
+    set_position_node.location = (200, 0)
+
+    # Drop points outside of the box |x|, |y|, |z| <= limit
+    abs_position = vector_math('ABSOLUTE', position, location=(200, 250))
+    separate_abs_node = nodes.new("ShaderNodeSeparateXYZ")
+    separate_abs_node.location = (400, 250)
+    links.new(abs_position, separate_abs_node.inputs['Vector'])
+    largest = math('MAXIMUM', math('MAXIMUM', separate_abs_node.outputs['X'], separate_abs_node.outputs['Y'], (600, 300)),
+                   separate_abs_node.outputs['Z'], (600, 150))
+    compare_node = nodes.new("FunctionNodeCompare")
+    compare_node.data_type = 'FLOAT'
+    compare_node.operation = 'GREATER_THAN'
+    compare_node.location = (600, 0)
+
+    delete_geometry_node = nodes.new("GeometryNodeDeleteGeometry")
+    delete_geometry_node.domain = 'POINT'
+    delete_geometry_node.location = (400, 0)
+
+    next_step = math('ADD', repeat_input_node.outputs['Step'], 1, (200, 150))
+    store_step_node = nodes.new("GeometryNodeStoreNamedAttribute")
+    store_step_node.data_type = 'FLOAT'
+    store_step_node.inputs['Name'].default_value = "step"
+    store_step_node.location = (800, 0)
+
+    join_geometry_node = nodes.new("GeometryNodeJoinGeometry")
+    join_geometry_node.location = (800, 200)
+
+    # Turn the trail in to one curve per seed ordered by step
+    seed_attribute_node = nodes.new("GeometryNodeInputNamedAttribute")
+    seed_attribute_node.data_type = 'INT'
+    seed_attribute_node.inputs['Name'].default_value = "seed"
+    seed_attribute_node.location = (1000, -250)
+
+    step_attribute_node = nodes.new("GeometryNodeInputNamedAttribute")
+    step_attribute_node.data_type = 'FLOAT'
+    step_attribute_node.inputs['Name'].default_value = "step"
+    step_attribute_node.location = (1000, -400)
+
+    points_to_curves_node = nodes.new("GeometryNodePointsToCurves")
+    points_to_curves_node.location = (1200, 0)
+
+    set_radius_node = nodes.new("GeometryNodeSetCurveRadius")
+    set_radius_node.inputs['Radius'].default_value = 0.2
+    set_radius_node.location = (1400, 0)
+
+    circle_curve_node = nodes.new("GeometryNodeCurvePrimitiveCircle")
+    circle_curve_node.inputs[0].default_value = 8
+    circle_curve_node.inputs[4].default_value = 0.2
+    circle_curve_node.location = (1600, -180)
+
+    curve_to_mesh_node = nodes.new("GeometryNodeCurveToMesh")
+    curve_to_mesh_node.location = (1800, 0)
+
+    # Link nodes
+    links.new(node_group_in.outputs['Geometry'], mesh_to_points_node.inputs['Mesh'])
+    links.new(mesh_to_points_node.outputs['Points'], store_seed_node.inputs['Geometry'])
+    links.new(index_node.outputs['Index'], store_seed_node.inputs['Value'])
+    links.new(store_seed_node.outputs['Geometry'], repeat_input_node.inputs['Geometry'])
+    links.new(store_seed_node.outputs['Geometry'], repeat_input_node.inputs['Trail'])
+    links.new(node_group_in.outputs['Steps'], repeat_input_node.inputs['Iterations'])
+
+    links.new(repeat_input_node.outputs['Geometry'], set_position_node.inputs['Geometry'])
+    links.new(offset, set_position_node.inputs['Offset'])
+    links.new(set_position_node.outputs['Geometry'], delete_geometry_node.inputs['Geometry'])
+    links.new(largest, compare_node.inputs['A'])
+    links.new(node_group_in.outputs['Limit'], compare_node.inputs['B'])
+    links.new(compare_node.outputs['Result'], delete_geometry_node.inputs['Selection'])
+    links.new(delete_geometry_node.outputs['Geometry'], store_step_node.inputs['Geometry'])
+    links.new(next_step, store_step_node.inputs['Value'])
+
+    links.new(store_step_node.outputs['Geometry'], repeat_output_node.inputs['Geometry'])
+    links.new(store_step_node.outputs['Geometry'], join_geometry_node.inputs['Geometry'])
+    links.new(repeat_input_node.outputs['Trail'], join_geometry_node.inputs['Geometry'])
+    links.new(join_geometry_node.outputs['Geometry'], repeat_output_node.inputs['Trail'])
+    links.new(next_step, repeat_output_node.inputs['Step'])
+
+    links.new(repeat_output_node.outputs['Trail'], points_to_curves_node.inputs['Points'])
+    links.new(seed_attribute_node.outputs['Attribute'], points_to_curves_node.inputs['Curve Group ID'])
+    links.new(step_attribute_node.outputs['Attribute'], points_to_curves_node.inputs['Weight'])
+    links.new(points_to_curves_node.outputs['Curves'], set_radius_node.inputs['Curve'])
+    links.new(circle_curve_node.outputs['Curve'], curve_to_mesh_node.inputs['Profile Curve'])
+
+    if color_flag:
+        # Store the min-max scaled speed for the material
+        speed = vector_math('LENGTH', velocity(position, (1400, -400)), location=(1600, -400))
+
+        store_speed_node = nodes.new("GeometryNodeStoreNamedAttribute")
+        store_speed_node.data_type = 'FLOAT'
+        store_speed_node.domain = 'POINT'
+        store_speed_node.inputs['Name'].default_value = "stream_col"
+        store_speed_node.location = (1600, 200)
+
+        statistic_node = nodes.new("GeometryNodeAttributeStatistic")
+        statistic_node.data_type = 'FLOAT'
+        statistic_node.domain = 'POINT'
+        statistic_node.location = (1800, -400)
+
+        map_range_node = nodes.new("ShaderNodeMapRange")
+        map_range_node.location = (2000, -400)
+
+        set_material_node = nodes.new("GeometryNodeSetMaterial")
+        set_material_node.location = (2000, 0)
+
+        links.new(set_radius_node.outputs['Curve'], statistic_node.inputs['Geometry'])
+        links.new(speed, statistic_node.inputs[2])
+        links.new(speed, map_range_node.inputs[0])
+        links.new(statistic_node.outputs['Min'], map_range_node.inputs[1])
+        links.new(statistic_node.outputs['Max'], map_range_node.inputs[2])
+
+        links.new(set_radius_node.outputs['Curve'], store_speed_node.inputs['Geometry'])
+        links.new(map_range_node.outputs[0], store_speed_node.inputs['Value'])
+        links.new(store_speed_node.outputs['Geometry'], curve_to_mesh_node.inputs['Curve'])
+        links.new(curve_to_mesh_node.outputs['Mesh'], set_material_node.inputs['Geometry'])
+        links.new(set_material_node.outputs['Geometry'], node_group_out.inputs['Geometry'])
+
+        # Set up material
+        create_material("Stream_Mat", "stream_col", color_min,
+                        color_max, set_material_node)
+    else:
+        links.new(set_radius_node.outputs['Curve'], curve_to_mesh_node.inputs['Curve'])
+        links.new(curve_to_mesh_node.outputs['Mesh'], node_group_out.inputs['Geometry'])
 
 
 def create_contour(func, syms, size_x, size_y, x_dim, y_dim, color_min, color_max):
@@ -1468,6 +1621,9 @@ def create_contour(func, syms, size_x, size_y, x_dim, y_dim, color_min, color_ma
     a scalar output. F(x, y, z) -> R
     Leave out variable(s) from equation to graph lower dimensional functions
     """
+    # Compile the function first so an expression over the node limit builds nothing
+    expression_group(func, syms)
+
     # Create boolean object and link it to scene
     mesh = bpy.data.meshes.new("Contour Boolean Graph")
     boolean_obj = bpy.data.objects.new("Contour Boolean Graph", mesh)
@@ -1944,6 +2100,9 @@ def create_slice(size_x, size_y):
 
 
 def create_curve(funcX, funcY, funcZ, syms, use_mesh, resolution, length):
+    # Compile the curve first so an expression over the node limit builds nothing
+    group = expression_group((funcX, funcY, funcZ), syms, True)
+
     # Create object and link it to scene
     mesh = bpy.data.meshes.new("Curve Graph")
     obj = bpy.data.objects.new("Curve Graph", mesh)
@@ -1990,9 +2149,6 @@ def create_curve(funcX, funcY, funcZ, syms, use_mesh, resolution, length):
     separate_xyz_node = nodes.new("ShaderNodeSeparateXYZ")
     separate_xyz_node.location = (-200, -500)
 
-    combine_xyz_node = nodes.new("ShaderNodeCombineXYZ")
-    combine_xyz_node.location = (200, -500)
-
     transform_node = nodes.new("GeometryNodeTransform")
     transform_node.name = "Master_Transform"
     transform_node.location = (0, 0)
@@ -2007,22 +2163,12 @@ def create_curve(funcX, funcY, funcZ, syms, use_mesh, resolution, length):
     node_group_out = nodes.get('Group Output')
     node_group_out.location = (600, 0)
 
-    # Instantiate NodeMath objects
-    nodemath_syms = instantiate_nodemath(
-        syms, node_group, node_group_in, separate_xyz_node, 0, -350)
-
-    # Populate and offset Blender nodes for X component
-    outX = scalar_check(funcX(*nodemath_syms), node_group, (0, -350))
-
-    # Populate and offset Blender nodes for Y component
-    for sym in nodemath_syms:
-        sym.offset_y = -500
-    outY = scalar_check(funcY(*nodemath_syms), node_group, (0, -500))
-
-    # Populate and offset Blender nodes for Z component
-    for sym in nodemath_syms:
-        sym.offset_y = -650
-    outZ = scalar_check(funcZ(*nodemath_syms), node_group, (0, -650))
+    # Reference the compiled X Y Z components through a shared expression group
+    out_vector = instantiate_expression(group, syms, node_group, node_group_in, {
+        'x': separate_xyz_node.outputs['X'],
+        'y': separate_xyz_node.outputs['Y'],
+        'z': separate_xyz_node.outputs['Z'],
+        'Position': input_position_node.outputs['Position']}, (0, -350))
 
     # Link nodes
     if use_mesh:
@@ -2039,12 +2185,8 @@ def create_curve(funcX, funcY, funcZ, syms, use_mesh, resolution, length):
     node_group.links.new(
         input_position_node.outputs['Position'], separate_xyz_node.inputs['Vector'])
 
-    node_group.links.new(outX.output, combine_xyz_node.inputs['X'])
-    node_group.links.new(outY.output, combine_xyz_node.inputs['Y'])
-    node_group.links.new(outZ.output, combine_xyz_node.inputs['Z'])
-
     node_group.links.new(
-        combine_xyz_node.outputs['Vector'], set_position_node.inputs['Position'])
+        out_vector, set_position_node.inputs['Position'])
     node_group.links.new(
         set_position_node.outputs['Geometry'], post_transform_node.inputs['Geometry'])
     node_group.links.new(
@@ -2056,6 +2198,9 @@ def create_surface(funcX, funcY, funcZ, syms, x_dim, y_dim):
     Function to create a 3D surface from three functions parameterized with two
     variables. F(x, y) -> R^3
     """
+    # Compile the surface first so an expression over the node limit builds nothing
+    group = expression_group((funcX, funcY, funcZ), syms)
+
     # Create graph
     create_graph("Surface Graph", None, None, 1, 1, x_dim, y_dim,
                  False, False, False, False, None, None, 0, 0, 0, '')
@@ -2070,6 +2215,7 @@ def create_surface(funcX, funcY, funcZ, syms, x_dim, y_dim):
     separate_xyz_node = node_search(nodes, 'Separate XYZ')
     separate_xyz_node.location = (-400, -300)
     combine_xyz_node = node_search(nodes, 'Combine XYZ')
+    set_position_node = node_search(nodes, 'Set Position')
     position_node = node_search(nodes, 'Position')
     position_node.location = (-600, -400)
 
@@ -2087,33 +2233,12 @@ def create_surface(funcX, funcY, funcZ, syms, x_dim, y_dim):
     map_range_y_node.inputs[4].default_value = 6.28319
     map_range_y_node.location = (-200, -350)
 
-    # Instantiate NodeMath objects
-    nodemath_syms = []
-    for i in range(len(syms)):
-        if syms[i] == 'x':
-            nodemath_syms.append(
-                NodeMath(map_range_x_node.outputs[0], node_group, 0, -100))
-        elif syms[i] == 'y':
-            nodemath_syms.append(
-                NodeMath(map_range_y_node.outputs[0], node_group, 0, -100))
-        elif syms[i] == 'z':
-            nodemath_syms.append(
-                NodeMath(separate_xyz_node.outputs['Z'], node_group, 0, -100))
-        else:
-            node_group.inputs.new('NodeSocketFloat', f"{syms[i]} variable")
-            nodemath_syms.append(
-                NodeMath(node_group_in.outputs[f"{syms[i]} variable"], node_group, 0, -100))
-
-    # Populate Blender nodes
-    outX = scalar_check(funcX(*nodemath_syms), node_group, (0, -100))
-
-    for sym in nodemath_syms:
-        sym.offset_y = -300
-    outY = scalar_check(funcY(*nodemath_syms), node_group, (0, -300))
-
-    for sym in nodemath_syms:
-        sym.offset_y = -500
-    outZ = scalar_check(funcZ(*nodemath_syms), node_group, (0, -500))
+    # Reference the compiled X Y Z components of the mapped (x, y) through a shared
+    # expression group
+    out_vector = instantiate_expression(group, syms, node_group, node_group_in, {
+        'x': map_range_x_node.outputs[0],
+        'y': map_range_y_node.outputs[0],
+        'z': separate_xyz_node.outputs['Z']}, (0, -100))
 
     # Link nodes
     node_group.links.new(
@@ -2121,6 +2246,7 @@ def create_surface(funcX, funcY, funcZ, syms, x_dim, y_dim):
     node_group.links.new(
         separate_xyz_node.outputs['Y'], map_range_y_node.inputs[0])
 
-    node_group.links.new(outX.output, combine_xyz_node.inputs['X'])
-    node_group.links.new(outY.output, combine_xyz_node.inputs['Y'])
-    node_group.links.new(outZ.output, combine_xyz_node.inputs['Z'])
+    # Replace the graph's combine XYZ node with the compiled vector
+    nodes.remove(combine_xyz_node)
+    node_group.links.new(
+        out_vector, set_position_node.inputs['Position'])
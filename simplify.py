@@ -0,0 +1,98 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import time
+
+import sympy
+
+from .compiler import NodeCompiler, VectorCompiler
+from .ir import CountingBackend, NodeBuilder, NodeMath
+
+
+# Candidate rewrites, cheapest first so a tight budget still tries the quick ones.
+# Common subexpressions need no rewrite, the node builder emits each of them once
+rewrites = (
+    ('expand', sympy.expand),
+    ('cancel', sympy.cancel),
+    ('factor', sympy.factor),
+    ('trigsimp', sympy.trigsimp),
+)
+
+# Rewrites that can run far past the budget in a single call, only tried on expressions
+# of at most expensive_size operations
+expensive_rewrites = {'factor', 'trigsimp'}
+expensive_size = 40
+
+
+class NodeLimitError(Exception):
+    """
+    Raised instead of building an expression that needs more nodes than allowed
+    """
+    pass
+
+
+def estimate(exprs, syms, position=False):
+    """
+    Nodes, links and per-vertex operations emitted for an expression, or the (X, Y, Z)
+    components of a vector, measured by compiling it with the counting backend
+    """
+    builder = NodeBuilder(CountingBackend())
+    nodemath_syms = [NodeMath(builder.input(sym), builder) for sym in syms]
+    compiler = NodeCompiler(syms, nodemath_syms)
+
+    if isinstance(exprs, tuple):
+        position_sym = NodeMath(builder.input('Position', True), builder) if position else None
+        out = VectorCompiler(compiler, position_sym).compile(exprs)
+    else:
+        out = compiler.compile(exprs)
+
+    # Constant expressions need a value node
+    if not isinstance(out, NodeMath):
+        return {'nodes': 1, 'links': 0, 'operations': 0}
+
+    out.socket()
+    backend = builder.backend
+    return {'nodes': backend.total(), 'links': backend.links, 'operations': backend.operations}
+
+
+def node_cost(exprs, syms, position=False):
+    return estimate(exprs, syms, position)['nodes']
+
+
+def simplest(exprs, syms, budget=1.0, position=False):
+    """
+    Try the rewrites on the expression (on all components of a vector) within budget
+    seconds and keep the form with the fewest nodes. Rewrites are chained greedily, a
+    pass over all of them is repeated on the best form while it keeps improving.
+    The budget is checked between rewrites, so the expensive ones are skipped on large
+    expressions. Returns (expression, report)
+    """
+    start = time.perf_counter()
+    vector = isinstance(exprs, tuple)
+
+    best_cost = node_cost(exprs, syms, position)
+    best, steps = exprs, []
+    original_cost = best_cost
+
+    improved = True
+    while improved:
+        improved = False
+        for name, rewrite in rewrites:
+            if time.perf_counter() - start > budget:
+                break
+            if name in expensive_rewrites and sympy.count_ops(best) > expensive_size:
+                continue
+
+            try:
+                candidate = tuple(rewrite(expr) for expr in best) if vector else rewrite(best)
+                cost = node_cost(candidate, syms, position)
+            except Exception:
+                # Rewrites that fail or produce unsupported functions are skipped
+                continue
+
+            if cost < best_cost:
+                best, best_cost = candidate, cost
+                steps.append(name)
+                improved = True
+
+    report = f"{', '.join(steps) or 'as typed'}: {original_cost} -> {best_cost} nodes"
+    return best, report
@@ -0,0 +1,605 @@
+# Copyright (C) 2022, Francis LaBounty, All rights reserved.
+
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# Name the standalone copy of this module is loaded under, worker processes cannot import
+# the addon package because it needs bpy
+standalone_name = 'graph_streamlines'
+standalone_loader = """
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location({name!r}, {path!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules[{name!r}] = module
+spec.loader.exec_module(module)
+"""
+
+pool = None
+pool_workers = 0
+
+# Fields lambdified by this worker process, by their srepr
+compiled = {}
+
+
+def evaluate(field, points):
+    """
+    Velocity of a lambdified vector field (see expressions.compile_field) at an
+    (n, 3) array of points, as an (n, 3) array. Constant components are broadcast
+    """
+    x, y, z = points.T
+    return np.stack([np.broadcast_to(component, x.shape) for component in field(x, y, z)], axis=1)
+
+
+def euler(f, points, velocity, dt, state):
+    """
+    Explicit Euler step
+    """
+    return (points + dt * velocity, None)
+
+
+def rk4(f, points, k1, dt, state):
+    """
+    Classic fourth order Runge-Kutta step
+    """
+    k2 = f(points + 0.5 * dt * k1)
+    k3 = f(points + 0.5 * dt * k2)
+    k4 = f(points + dt * k3)
+    return (points + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4), None)
+
+
+# Dormand-Prince tableau, rows of a, 5th order weights b and the error weights
+# (5th order minus embedded 4th order)
+dormand_prince_a = (
+    (),
+    (1 / 5,),
+    (3 / 40, 9 / 40),
+    (44 / 45, -56 / 15, 32 / 9),
+    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+    (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+)
+dormand_prince_error = (71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+
+
+def dormand_prince(f, points, k1, dt, state, attempts=8):
+    """
+    Adaptive Runge-Kutta 4(5) step. Every seed keeps its own step size, seeds whose
+    error is over the tolerance retry with a smaller step until they pass or run out of
+    attempts. Step sizes grow up to 10 dt where the field is smooth
+    """
+    tolerance = state['tolerance']
+    h = state.setdefault('h', np.full((points.shape[0], 1), dt))
+    new_points = points.copy()
+    new_velocity = np.empty_like(k1)
+    pending = np.arange(points.shape[0])
+
+    for attempt in range(attempts):
+        y, hp = points[pending], h[pending]
+        k = [k1[pending]]
+        for row in dormand_prince_a[1:]:
+            k.append(f(y + hp * sum(a * ki for a, ki in zip(row, k) if a)))
+
+        # The last stage is evaluated at the 5th order solution (first same as last)
+        y5 = y + hp * sum(a * ki for a, ki in zip(dormand_prince_a[-1], k) if a)
+        error = np.abs(hp * sum(e * ki for e, ki in zip(dormand_prince_error, k) if e))
+        scale = tolerance * (1 + np.maximum(np.abs(y), np.abs(y5)))
+        error = np.sqrt(np.mean((error / scale)**2, axis=1))
+
+        accepted = error <= 1
+        if attempt == attempts - 1:
+            accepted[:] = True
+
+        # Standard step size controller with safety factor 0.9
+        with np.errstate(divide='ignore'):
+            factor = np.clip(0.9 * error**-0.2, 0.2, 5.0)
+        factor[~np.isfinite(factor)] = 0.2
+        h[pending] = np.clip(hp * factor[:, None], -10 * abs(dt), 10 * abs(dt))
+
+        done = pending[accepted]
+        new_points[done] = y5[accepted]
+        new_velocity[done] = k[-1][accepted]
+        pending = pending[~accepted]
+        if pending.size == 0:
+            break
+
+    return (new_points, new_velocity)
+
+
+def momentum(f, points, velocity, dt, state, beta=0.9):
+    """
+    Heavy ball step, the direction is an exponential average of the past velocities
+    """
+    average = state.get('momentum', 0) * beta + velocity
+    state['momentum'] = average
+    return (points + dt * average, None)
+
+
+def adam(f, points, velocity, dt, state, beta1=0.9, beta2=0.999, epsilon=1e-8):
+    """
+    Adam step, per coordinate steps of about dt from bias corrected first and second
+    moment estimates of the velocity
+    """
+    t = state['t'] = state.get('t', 0) + 1
+    first = state['first'] = beta1 * state.get('first', 0) + (1 - beta1) * velocity
+    second = state['second'] = beta2 * state.get('second', 0) + (1 - beta2) * velocity**2
+    first_hat = first / (1 - beta1**t)
+    second_hat = second / (1 - beta2**t)
+    return (points + dt * first_hat / (np.sqrt(second_hat) + epsilon), None)
+
+
+integrators = {
+    'EULER': euler,
+    'RK4': rk4,
+    'RK45': dormand_prince,
+    'MOMENTUM': momentum,
+    'ADAM': adam,
+}
+
+
+class Trajectories():
+    """
+    Streams integrated so far from a set of seeds (see integrate). The points, velocities
+    and integrator state where they stopped are kept, so asking for more steps later
+    continues them instead of starting over
+    """
+
+    def __init__(self, field, seeds, dt=0.1, surface=None, direction=1.0, method='EULER', tolerance=1e-4,
+                 bound=None, min_speed=0.0, max_length=None):
+        self.field = field
+        self.surface = surface
+        self.dt = dt
+        self.direction = direction
+        self.step_function = integrators[method]
+        self.state = {'tolerance': tolerance}
+        self.bound = bound
+        self.min_speed = min_speed
+        self.max_length = max_length
+
+        seeds = np.asarray(seeds, dtype=np.float64).reshape(-1, 3)
+        self.positions = np.empty((seeds.shape[0], 1, 3), dtype=np.float32)
+        self.velocities = np.empty((seeds.shape[0], 1, 3), dtype=np.float32)
+        self.lengths = np.ones(seeds.shape[0], dtype=np.int64)
+        self.steps = 1
+
+        with np.errstate(all='ignore'):
+            velocity = self.f(seeds)
+            self.positions[:, 0] = seeds
+            self.velocities[:, 0] = velocity
+
+            keep = ~self.finished(seeds, velocity) & (np.linalg.norm(velocity, axis=1) >= min_speed)
+            self.active = np.flatnonzero(keep)
+            self.points, self.velocity = seeds[keep], velocity[keep]
+            self.arc = np.zeros(self.active.size)
+
+    def f(self, points):
+        return self.direction * evaluate(self.field, points)
+
+    def finished(self, points, velocity):
+        stop = ~(np.isfinite(points).all(axis=1) & np.isfinite(velocity).all(axis=1))
+        if self.bound is not None:
+            stop |= (np.abs(points) > self.bound).any(axis=1)
+        return stop
+
+    def advance(self, steps):
+        """
+        Integrate the streams that have not stopped until they have steps points
+        """
+        if steps <= self.steps:
+            return
+
+        # Grow the buffers for the new steps
+        extra = (self.positions.shape[0], steps - self.steps, 3)
+        self.positions = np.concatenate((self.positions, np.empty(extra, dtype=np.float32)), axis=1)
+        self.velocities = np.concatenate((self.velocities, np.empty(extra, dtype=np.float32)), axis=1)
+
+        # Division by zero and overflow end the stream they happen in
+        with np.errstate(all='ignore'):
+            for step in range(self.steps, steps):
+                if self.active.size == 0:
+                    break
+
+                previous = self.points
+                points, velocity = self.step_function(self.f, self.points, self.velocity, self.dt, self.state)
+                if self.surface is not None:
+                    x, y, z = points.T
+                    points[:, 2] = self.surface(x, y, z)
+                    velocity = None
+
+                # Integrators that end on an evaluation at the new points hand it over
+                if velocity is None:
+                    velocity = self.f(points)
+
+                valid = ~self.finished(points, velocity)
+                recorded = self.active[valid]
+                self.positions[recorded, step] = points[valid]
+                self.velocities[recorded, step] = velocity[valid]
+                self.lengths[recorded] = step + 1
+
+                self.arc += np.linalg.norm(points - previous, axis=1)
+                keep = valid & (np.linalg.norm(velocity, axis=1) >= self.min_speed)
+                if self.max_length is not None:
+                    keep &= self.arc < self.max_length
+                self.points, self.velocity = points, velocity
+
+                # Drop finished seeds from the integration and the integrator state
+                if not keep.all():
+                    self.active, self.points, self.velocity, self.arc = (
+                        self.active[keep], self.points[keep], self.velocity[keep], self.arc[keep])
+                    for key, value in self.state.items():
+                        if isinstance(value, np.ndarray) and value.ndim and value.shape[0] == keep.size:
+                            self.state[key] = value[keep]
+
+        self.steps = steps
+
+    def result(self, steps):
+        """
+        (positions, velocities, lengths) of the first steps points of every stream, see
+        integrate
+        """
+        self.advance(steps)
+        lengths = np.minimum(self.lengths, steps)
+
+        # Pad every stream with its last point
+        index = np.minimum(np.arange(steps), lengths[:, None] - 1)[:, :, None]
+        positions = np.take_along_axis(self.positions[:, :steps], index, axis=1)
+        velocities = np.take_along_axis(self.velocities[:, :steps], index, axis=1)
+        return (positions, velocities, lengths)
+
+
+def integrate(field, seeds, dt=0.1, steps=50, surface=None, direction=1.0, method='EULER', tolerance=1e-4,
+              bound=None, min_speed=0.0, max_length=None):
+    """
+    Advance every seed through the field at once with the integrator named by method
+    (see integrators). With surface (a lambdified F(x, y, z)) each point is projected
+    back on to z = F, direction is -1 to walk against the field (gradient descent).
+    tolerance is the relative error allowed per step by RK45.
+
+    A stream stops at the first point that is not finite or leaves the box
+    |x|, |y|, |z| <= bound, and after the point where its speed drops below min_speed
+    or its length passes max_length. Finished seeds are no longer evaluated.
+    Returns (positions, velocities, lengths), (nseeds, steps, 3) float32 arrays where
+    each stream is padded with its last point, and the point count of each stream
+    """
+    trajectories = Trajectories(field, seeds, dt, surface, direction, method, tolerance, bound,
+                                min_speed, max_length)
+    return trajectories.result(steps)
+
+
+# Trajectories by field, seeds and integrator settings, so changing the step count only
+# extends or truncates them
+trajectory_cache = OrderedDict()
+trajectory_cache_size = 8
+
+
+def cached_integrate(source, field, seeds, dt=0.1, steps=50, surface=None, direction=1.0, method='EULER',
+                     tolerance=1e-4, bound=None, min_speed=0.0, max_length=None):
+    """
+    integrate, reusing the trajectories of an earlier call with the same source (a key
+    identifying the field and surface, like the srepr of their expressions), seeds and
+    settings. More steps continue them from where they stopped, fewer truncate them
+    """
+    seeds = np.asarray(seeds, dtype=np.float64).reshape(-1, 3)
+    key = (source, hashlib.sha1(seeds.tobytes()).hexdigest(), dt, direction, method, tolerance,
+           bound, min_speed, max_length)
+
+    trajectories = trajectory_cache.get(key)
+    if trajectories is None:
+        trajectories = Trajectories(field, seeds, dt, surface, direction, method, tolerance, bound,
+                                    min_speed, max_length)
+        trajectory_cache[key] = trajectories
+        if len(trajectory_cache) > trajectory_cache_size:
+            trajectory_cache.popitem(last=False)
+    trajectory_cache.move_to_end(key)
+
+    return trajectories.result(steps)
+
+
+def curvature(positions):
+    """
+    Discrete curvature at every point of (nseeds, steps, 3) streams: the turning angle
+    between the segments meeting at a point over their mean length. End points and
+    points where the stream has stopped are 0
+    """
+    curvatures = np.zeros(positions.shape[:2], dtype=np.float32)
+    before = positions[:, 1:-1] - positions[:, :-2]
+    after = positions[:, 2:] - positions[:, 1:-1]
+    angle = np.arctan2(np.linalg.norm(np.cross(before, after), axis=2), np.sum(before * after, axis=2))
+    length = 0.5 * (np.linalg.norm(before, axis=2) + np.linalg.norm(after, axis=2))
+    np.divide(angle, length, out=curvatures[:, 1:-1], where=length > 0)
+    return curvatures
+
+
+class SpatialHash():
+    """
+    Points bucketed in to a uniform grid of cells, so the test for a point closer than
+    radius to any stored point only looks at the neighbouring cells
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def keys(self, points):
+        return [tuple(cell) for cell in np.floor(np.asarray(points) / self.cell_size).astype(np.int64).tolist()]
+
+    def insert(self, points):
+        for point, key in zip(np.asarray(points).tolist(), self.keys(points)):
+            self.cells.setdefault(key, []).append(point)
+
+    def near(self, point, key, radius):
+        """
+        Whether any stored point is closer than radius to point, whose cell is key
+        """
+        reach = int(np.ceil(radius / self.cell_size))
+        radius2 = radius * radius
+        x, y, z = point
+        i, j, k = key
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                for dk in range(-reach, reach + 1):
+                    for px, py, pz in self.cells.get((i + di, j + dj, k + dk), ()):
+                        if (px - x)**2 + (py - y)**2 + (pz - z)**2 < radius2:
+                            return True
+        return False
+
+
+def poisson_disk(low, high, radius, attempts=30, rng=None):
+    """
+    Points filling the box low..high no closer than radius to each other (Bridson's
+    algorithm). Axes where the box is flat are left flat, so a box with zero height
+    gives a 2D sampling
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+    free = (high - low) > 0
+
+    grid = SpatialHash(radius)
+    first = low + rng.random(3) * (high - low)
+    points = [first]
+    grid.insert([first])
+    active = [first]
+
+    while active:
+        index = rng.integers(len(active))
+        center = active[index]
+
+        # Candidates in the shell between radius and 2 radius around an active point
+        directions = rng.normal(size=(attempts, 3)) * free
+        directions /= np.maximum(np.linalg.norm(directions, axis=1, keepdims=True), 1e-12)
+        candidates = center + directions * radius * (1 + rng.random((attempts, 1)))
+
+        for candidate, key in zip(candidates, grid.keys(candidates)):
+            if (candidate >= low).all() and (candidate <= high).all() and not grid.near(candidate, key, radius):
+                points.append(candidate)
+                active.append(candidate)
+                grid.insert([candidate])
+                break
+        else:
+            active[index] = active[-1]
+            active.pop()
+
+    return np.array(points)
+
+
+def magnitude_weighted(field, low, high, count, oversample=10, rng=None):
+    """
+    count points in the box low..high drawn with probability proportional to the speed
+    of the field, so fast regions get denser seeds
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+    candidates = low + rng.random((count * oversample, 3)) * (high - low)
+
+    with np.errstate(all='ignore'):
+        speed = np.linalg.norm(evaluate(field, candidates), axis=1)
+    speed[~np.isfinite(speed)] = 0
+
+    # Points where the field vanishes keep a tiny weight so count can always be drawn
+    weights = speed + 1e-9 * max(speed.max(), 1.0)
+    index = rng.choice(candidates.shape[0], size=count, replace=False, p=weights / weights.sum())
+    return candidates[index]
+
+
+def perpendicular_seeds(points, velocities, separation, free):
+    """
+    Candidate seeds separation away from a stream on both sides, in the plane of the
+    free axes for a 2D box and along two normals of the stream in 3D
+    """
+    tangents = velocities / np.maximum(np.linalg.norm(velocities, axis=1, keepdims=True), 1e-12)
+    if free.sum() == 2:
+        a, b = np.flatnonzero(free)
+        normals = np.zeros_like(tangents)
+        normals[:, a], normals[:, b] = -tangents[:, b], tangents[:, a]
+        offsets = [normals]
+    elif free.sum() == 3:
+        # Cross with the axis least aligned with the stream
+        axes = np.eye(3)[np.argmin(np.abs(tangents), axis=1)]
+        normals = np.cross(tangents, axes)
+        normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+        offsets = [normals, np.cross(tangents, normals)]
+    else:
+        return []
+
+    seeds = []
+    for offset in offsets:
+        seeds.extend(points + separation * offset)
+        seeds.extend(points - separation * offset)
+    return seeds
+
+
+def evenly_spaced(field, low, high, separation, dt=0.1, steps=50, surface=None, direction=1.0,
+                  method='EULER', tolerance=1e-4, bound=None, min_speed=0.0, max_length=None,
+                  test_ratio=0.5, max_streams=1000, batch=64, rng=None):
+    """
+    Evenly spaced streams (Jobard-Lefer) in the box low..high. New seeds are placed
+    separation away from accepted streams, a stream is cut where it comes closer than
+    test_ratio separation to the points of another and is dropped if that leaves less
+    than two points. Seeds not covered by the first stream's neighbours come from a
+    Poisson disk sampling of the box. Candidates are integrated batch at a time with
+    integrate. Returns (positions, velocities, lengths) like integrate
+    """
+    low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+    free = (high - low) > 0
+    grid = SpatialHash(separation)
+
+    # Seed from the center first, then wherever the neighbours of accepted streams did not reach
+    queue = [(low + high) / 2]
+    queue.extend(poisson_disk(low, high, 2 * separation, rng=rng))
+    queue.reverse()
+
+    positions, velocities, lengths = [], [], []
+    while queue and len(lengths) < max_streams:
+        candidates = []
+        while queue and len(candidates) < batch:
+            seed = queue.pop()
+            inside = (seed >= low).all() and (seed <= high).all()
+            if inside and not grid.near(seed, grid.keys([seed])[0], separation):
+                candidates.append(seed)
+        if not candidates:
+            continue
+
+        streams, speeds, counts = integrate(field, candidates, dt, steps, surface, direction, method,
+                                            tolerance, bound, min_speed, max_length)
+
+        for stream, speed, count in zip(streams, speeds, counts):
+            # An earlier stream of the batch may have claimed the seed
+            keys = grid.keys(stream[:count])
+            if grid.near(stream[0], keys[0], separation):
+                continue
+
+            for i in range(1, count):
+                if grid.near(stream[i], keys[i], test_ratio * separation):
+                    count = i
+                    break
+            if count < 2 or len(lengths) >= max_streams:
+                continue
+
+            grid.insert(stream[:count])
+            positions.append(stream)
+            velocities.append(speed)
+            lengths.append(count)
+
+            # Neighbours go to the front of the queue, before the fallback seeds
+            queue.extend(perpendicular_seeds(stream[:count], speed[:count], separation, free)[::-1])
+
+    if not lengths:
+        return (np.empty((0, steps, 3), dtype=np.float32), np.empty((0, steps, 3), dtype=np.float32),
+                np.empty(0, dtype=np.int64))
+
+    # Pad the cut streams with their last point like integrate does
+    positions, velocities, lengths = np.array(positions), np.array(velocities), np.array(lengths)
+    index = np.minimum(np.arange(steps), lengths[:, None] - 1)[:, :, None]
+    return (np.take_along_axis(positions, index, axis=1), np.take_along_axis(velocities, index, axis=1), lengths)
+
+
+def standalone():
+    """
+    This module loaded outside of the addon package, so the functions handed to worker
+    processes are pickled by a name the workers can import
+    """
+    if standalone_name not in sys.modules:
+        exec(standalone_loader.format(name=standalone_name, path=os.path.abspath(__file__)), {})
+    return sys.modules[standalone_name]
+
+
+def shared_array(memory, shape, dtype):
+    return np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def lambdify_source(source):
+    """
+    Lambdify the srepr of an expression, or a tuple of them for a vector field, once
+    per worker process
+    """
+    if source not in compiled:
+        import sympy
+
+        xyz = sympy.symbols('x y z')
+        if isinstance(source, tuple):
+            compiled[source] = sympy.lambdify(xyz, [sympy.sympify(expr) for expr in source], cse=True)
+        else:
+            compiled[source] = sympy.lambdify(xyz, sympy.sympify(source))
+    return compiled[source]
+
+
+def work(field_source, surface_source, names, nseeds, steps, start, stop, settings):
+    """
+    Worker process side of integrate_parallel, integrating the seeds start:stop and
+    writing them in to the shared buffers
+    """
+    field = lambdify_source(field_source)
+    surface = lambdify_source(surface_source) if surface_source is not None else None
+
+    # Spawned workers share the resource tracker of the parent, which unlinks the memory
+    memories = [SharedMemory(name) for name in names]
+    try:
+        seeds = shared_array(memories[0], (nseeds, 3), np.float64)
+        positions = shared_array(memories[1], (nseeds, steps, 3), np.float32)
+        velocities = shared_array(memories[2], (nseeds, steps, 3), np.float32)
+        lengths = shared_array(memories[3], (nseeds,), np.int64)
+
+        dt, direction, method, tolerance, bound, min_speed, max_length = settings
+        results = integrate(field, seeds[start:stop], dt, steps, surface, direction, method,
+                            tolerance, bound, min_speed, max_length)
+        positions[start:stop], velocities[start:stop], lengths[start:stop] = results
+        del seeds, positions, velocities, lengths
+    finally:
+        for memory in memories:
+            memory.close()
+
+
+def integrate_parallel(field_source, seeds, dt=0.1, steps=50, surface_source=None, direction=1.0,
+                       method='EULER', tolerance=1e-4, bound=None, min_speed=0.0, max_length=None,
+                       workers=0, chunks_per_worker=4):
+    """
+    integrate split in to chunks of seeds run by a pool of worker processes (workers,
+    0 for one per core). The field and surface are given by the srepr of their sympy
+    expressions and lambdified again in every worker. Seeds and results are passed
+    through shared memory
+    """
+    global pool, pool_workers
+    workers = workers or os.cpu_count() or 1
+    if pool is None or pool_workers != workers:
+        shutdown()
+        loader = standalone_loader.format(name=standalone_name, path=os.path.abspath(__file__))
+        pool = ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=exec,
+                                   initargs=(loader, {}))
+        pool_workers = workers
+
+    seeds = np.asarray(seeds, dtype=np.float64).reshape(-1, 3)
+    nseeds = seeds.shape[0]
+    shapes = (((nseeds, 3), np.float64), ((nseeds, steps, 3), np.float32),
+              ((nseeds, steps, 3), np.float32), ((nseeds,), np.int64))
+    memories = [SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+                for shape, dtype in shapes]
+
+    try:
+        shared_array(memories[0], *shapes[0])[:] = seeds
+
+        bounds = np.linspace(0, nseeds, min(nseeds, workers * chunks_per_worker) + 1).astype(int)
+        settings = (dt, direction, method, tolerance, bound, min_speed, max_length)
+        names = [memory.name for memory in memories]
+        futures = [pool.submit(standalone().work, field_source, surface_source, names, nseeds, steps, start, stop, settings)
+                   for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        for future in futures:
+            future.result()
+
+        return tuple(shared_array(memory, *shape).copy() for memory, shape in zip(memories[1:], shapes[1:]))
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+def shutdown():
+    global pool
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+        pool = None